@@ -215,18 +215,11 @@ class ProposalDuplicatesTest(GSoCDjangoTestCase, TaskQueueTestCase):
     self.assertTasksInQueue(n=1)
     self.assertTasksInQueue(n=1, url=self.CALCULATE_URL)
 
-    # this data should be used for the second iteration
-    params = self.get_tasks()[0]['params']
-    for key, value in params.iteritems():
-      params[key] = urllib.unquote_plus(value)
-
-    # clean the queue
-    self.clear_task_queue()
-
-    response = self.post(self.CALCULATE_URL, params)
-
-    # only 1 org in test data so task should terminate now
-    self.assertEqual(response.status_code, httplib.OK)
+    # run the rest of the chain, only 1 org in test data so the second
+    # iteration should terminate
+    responses = self.executeTasks(url=self.CALCULATE_URL)
+    self.assertLength(responses, 1)
+    self.assertEqual(responses[0].status_code, httplib.OK)
     self.assertTasksInQueue(n=0)
 
     # 1 duplicate should be left after task termination
@@ -0,0 +1,94 @@
+#!/usr/bin/env python2.5
+#
+# Copyright 2012 the Melange authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utils for controlling the current time as seen by the test helpers.
+"""
+
+
+import datetime
+
+
+class Clock(object):
+  """Clock which returns the real current time.
+  """
+
+  def now(self):
+    """Returns the current date.
+    """
+    return datetime.datetime.today()
+
+
+class FrozenClock(Clock):
+  """Clock which stands still until it is explicitly advanced.
+
+  The time of a FrozenClock never goes backwards, so all dates computed
+  from it within a test are consistent with each other.
+  """
+
+  def __init__(self, now=None):
+    """Initializes the FrozenClock.
+
+    Args:
+      now: the date at which the clock is frozen, defaults to the
+          real current date
+    """
+    if now is None:
+      now = datetime.datetime.today()
+    self._now = now
+
+  def now(self):
+    """Returns the date at which the clock is frozen.
+    """
+    return self._now
+
+  def advance(self, delta=None, **kwargs):
+    """Moves the clock forward and returns the new date.
+
+    Args:
+      delta: a timedelta by which to advance the clock
+      kwargs: if delta is not specified, the arguments of the timedelta
+          by which to advance the clock, e.g. days=1
+    """
+    if delta is None:
+      delta = datetime.timedelta(**kwargs)
+    if delta < datetime.timedelta(0):
+      raise ValueError('A frozen clock cannot be moved backwards.')
+    self._now += delta
+    return self._now
+
+
+# the clock used by the test helpers
+_clock = Clock()
+
+
+def getClock():
+  """Returns the clock currently used by the test helpers.
+  """
+  return _clock
+
+
+def setClock(clock):
+  """Sets the clock used by the test helpers and returns it.
+  """
+  global _clock
+  _clock = clock
+  return clock
+
+
+def now():
+  """Returns the current date according to the current clock.
+  """
+  return _clock.now()
@@ -27,6 +27,8 @@ from soc.modules.gci.models.work_submission import GCIWorkSubmission
 
 from soc.modules.seeder.logic.seeder import logic as seeder_logic
 
+from tests import clock_utils
+
 
 class GCITaskHelper(object):
   """Helper class to aid in manipulating GCI task data.
@@ -65,17 +67,40 @@ class GCITaskHelper(object):
       mentors: mentors for the task
       student: student who claimed the task
     """
+    properties = self._taskProperties(status, org, mentors, student, override)
+    return self.seed(GCITask, properties)
+
+  def addTasks(self, graph, status, org, mentors, student=None, n=1,
+               override={}):
+    """Adds n GCI tasks with mentors to graph.
+
+    Args:
+      graph: the SeedGraph to add the tasks to
+      status: the status of the tasks
+      org: the org under which the tasks are created
+      mentors: mentors for the tasks
+      student: student who claimed the tasks
+      n: the number of tasks
+    """
+    properties = self._taskProperties(status, org, mentors, student, override)
+    return graph.addn(GCITask, properties, n,
+                      auto_seed_optional_properties=False)
+
+  def _taskProperties(self, status, org, mentors, student, override):
+    """Returns the properties of a GCI task with mentors.
+    """
+    now = clock_utils.now()
     properties = {'program': self.program, 'org': org, 'status': status,
         'difficulty': DIFFICULTIES[0],
         'task_type': self.program.task_types[0],
         'mentors': [mentor.key() for mentor in mentors], 'student': student,
         'user': student.user if student else None,
         'created_by': mentors[0], 'modified_by': mentors[0],
-        'created_on': datetime.datetime.now() - datetime.timedelta(20),
-        'modified_on': datetime.datetime.now() - datetime.timedelta(10)
+        'created_on': now - datetime.timedelta(20),
+        'modified_on': now - datetime.timedelta(10)
     }
     properties.update(override)
-    return self.seed(GCITask, properties)
+    return properties
 
   def createWorkSubmission(self, task, student, url='http://www.example.com/'):
     """Creates a GCIWorkSubmission.
@@ -0,0 +1,336 @@
+#!/usr/bin/env python2.5
+#
+# Copyright 2012 the Melange authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""In-memory datastore stub used by the test runner.
+"""
+
+
+import bisect
+import threading
+
+from google.appengine.api import datastore_file_stub
+from google.appengine.api import datastore_types
+from google.appengine.datastore import datastore_pb
+from google.appengine.datastore import datastore_stub_util
+
+
+# filter operators for which the property indexes are used to narrow down
+# the candidate entities of a query; bounds are treated as inclusive, which
+# is fine because all filters are applied to the candidates afterwards
+_EQUAL = datastore_pb.Query_Filter.EQUAL
+_LOWER_BOUNDS = [
+    datastore_pb.Query_Filter.GREATER_THAN,
+    datastore_pb.Query_Filter.GREATER_THAN_OR_EQUAL,
+]
+_UPPER_BOUNDS = [
+    datastore_pb.Query_Filter.LESS_THAN,
+    datastore_pb.Query_Filter.LESS_THAN_OR_EQUAL,
+]
+
+
+class _StoredEntity(object):
+  """Stored entity record, kept as is rather than as an encoded protobuf.
+  """
+
+  def __init__(self, record):
+    self.record = record
+
+
+class _PropertyIndex(object):
+  """Index of the values of a single property of a single kind.
+  """
+
+  def __init__(self):
+    # maps a property key value to the set of entity keys having that value
+    self.entities = {}
+    # sorted list of self.entities keys, rebuilt lazily after writes
+    self._values = None
+
+  def add(self, value, k):
+    """Adds the entity key k under value.
+    """
+    if value not in self.entities:
+      self.entities[value] = set()
+      self._values = None
+    self.entities[value].add(k)
+
+  def remove(self, value, k):
+    """Removes the entity key k from value.
+    """
+    keys = self.entities.get(value)
+    if keys is None:
+      return
+    keys.discard(k)
+    if not keys:
+      del self.entities[value]
+      self._values = None
+
+  def lookup(self, value):
+    """Returns the set of entity keys having exactly the specified value.
+    """
+    return self.entities.get(value, set())
+
+  def range(self, start=None, end=None):
+    """Returns the set of entity keys with a value in [start, end].
+
+    Either bound may be None, meaning that side of the range is open.
+    """
+    if self._values is None:
+      self._values = sorted(self.entities)
+
+    lo = 0
+    if start is not None:
+      lo = bisect.bisect_left(self._values, start)
+    hi = len(self._values)
+    if end is not None:
+      hi = bisect.bisect_right(self._values, end)
+
+    result = set()
+    for value in self._values[lo:hi]:
+      result.update(self.entities[value])
+    return result
+
+
+def _indexedValues(entity):
+  """Returns a list of (property name, key value) pairs for entity.
+  """
+  return [(prop.name(), datastore_types.PropertyValueToKeyValue(prop.value()))
+          for prop in entity.property_list()]
+
+
+class MemoryDatastoreStub(datastore_file_stub.DatastoreFileStub):
+  """Datastore stub which keeps all entities in plain dictionaries.
+
+  Unlike DatastoreFileStub it never encodes the stored entities, it keeps
+  an index per (kind, property) that is used to narrow down the candidates
+  of equality and inequality filters, and it resolves ancestor queries by
+  entity group. Everything else, i.e. transactions, id allocation, the
+  application of filters, sort orders, cursors, offsets and limits, is
+  inherited, so queries return the same results as with the file stub.
+  Clearing the stub drops all dictionaries at once.
+  """
+
+  def __init__(self, app_id, **kwargs):
+    """Initializes the MemoryDatastoreStub.
+
+    Args:
+      app_id: the application id
+      kwargs: any other arguments accepted by DatastoreFileStub, except
+          for datastore_file and save_changes
+    """
+    self._entities_by_kind = {}
+    self._entities_by_group = {}
+    self._property_indexes = {}
+    # guards the dictionaries above, like the entities lock of the file stub
+    self._entities_lock = threading.RLock()
+    kwargs.setdefault('use_atexit', False)
+    super(MemoryDatastoreStub, self).__init__(
+        app_id, None, save_changes=False, **kwargs)
+
+  def Clear(self):
+    """Clears the datastore by dropping all stored entities and indexes.
+    """
+    datastore_stub_util.BaseDatastore.Clear(self)
+    datastore_stub_util.DatastoreStub.Clear(self)
+    self._entities_lock.acquire()
+    try:
+      self._entities_by_kind = {}
+      self._entities_by_group = {}
+      self._property_indexes = {}
+    finally:
+      self._entities_lock.release()
+
+  def Read(self):
+    """Does nothing, there is no backing file to read from.
+    """
+    pass
+
+  def Write(self):
+    """Does nothing, there is no backing file to write to.
+    """
+    pass
+
+  def _GetAllEntities(self):
+    """Returns a map from (app namespace, kind) to stored entities.
+    """
+    return self._entities_by_kind
+
+  def _GetSchemaCache(self, kind, usekey):
+    # the schema is only used by metadata queries, do not cache it
+    return None
+
+  def _SetSchemaCache(self, kind, usekey, value):
+    pass
+
+  def _index(self, app_kind, k, entity):
+    """Adds entity to the property indexes of its kind.
+    """
+    for name, value in _indexedValues(entity):
+      index = self._property_indexes.get((app_kind, name))
+      if index is None:
+        index = self._property_indexes[app_kind, name] = _PropertyIndex()
+      index.add(value, k)
+
+  def _unindex(self, app_kind, k, entity):
+    """Removes entity from the property indexes of its kind.
+    """
+    for name, value in _indexedValues(entity):
+      index = self._property_indexes.get((app_kind, name))
+      if index is not None:
+        index.remove(value, k)
+
+  def _Put(self, record, insert):
+    self._entities_lock.acquire()
+    try:
+      record = datastore_stub_util.StoreRecord(record)
+      app_kind, eg_k, k = self._GetEntityLocation(record.entity.key())
+
+      by_kind = self._entities_by_kind.setdefault(app_kind, {})
+      assert not insert or k not in by_kind
+
+      old = by_kind.get(k)
+      if old is not None:
+        self._unindex(app_kind, k, old.record.entity)
+
+      stored_entity = _StoredEntity(record)
+      by_kind[k] = stored_entity
+      self._entities_by_group.setdefault(eg_k, {})[k] = stored_entity
+      self._index(app_kind, k, record.entity)
+    finally:
+      self._entities_lock.release()
+
+  def _Get(self, key):
+    self._entities_lock.acquire()
+    try:
+      app_kind, _, k = self._GetEntityLocation(key)
+      stored_entity = self._entities_by_kind.get(app_kind, {}).get(k)
+      if stored_entity is not None:
+        return datastore_stub_util.LoadRecord(stored_entity.record)
+    finally:
+      self._entities_lock.release()
+
+  def _Delete(self, key):
+    self._entities_lock.acquire()
+    try:
+      app_kind, eg_k, k = self._GetEntityLocation(key)
+
+      by_kind = self._entities_by_kind.get(app_kind, {})
+      stored_entity = by_kind.pop(k, None)
+      if stored_entity is None:
+        return
+      self._unindex(app_kind, k, stored_entity.record.entity)
+      if not by_kind:
+        del self._entities_by_kind[app_kind]
+
+      by_group = self._entities_by_group[eg_k]
+      del by_group[k]
+      if not by_group:
+        del self._entities_by_group[eg_k]
+    finally:
+      self._entities_lock.release()
+
+  def _GetEntitiesInEntityGroup(self, entity_group):
+    self._entities_lock.acquire()
+    try:
+      eg_k = datastore_types.ReferenceToKeyValue(entity_group)
+      return dict((k, e.record) for (k, e) in
+                  self._entities_by_group.get(eg_k, {}).iteritems())
+    finally:
+      self._entities_lock.release()
+
+  def _candidateKeys(self, app_kind, filters):
+    """Returns the set of entity keys that may match filters.
+
+    Returns None if none of the filters can be answered by an index.
+    """
+    candidates = None
+    bounds = {}
+
+    for query_filter in filters:
+      if query_filter.property_size() != 1:
+        continue
+      prop = query_filter.property(0)
+      # special properties such as __key__ are not indexed, the filter is
+      # applied to the candidates later on
+      if prop.name().startswith('__'):
+        continue
+      op = query_filter.op()
+      index = self._property_indexes.get((app_kind, prop.name()))
+      value = datastore_types.PropertyValueToKeyValue(prop.value())
+
+      if op == _EQUAL:
+        keys = index and index.lookup(value) or set()
+      elif op in _LOWER_BOUNDS:
+        bounds.setdefault(prop.name(), [None, None])[0] = value
+        continue
+      elif op in _UPPER_BOUNDS:
+        bounds.setdefault(prop.name(), [None, None])[1] = value
+        continue
+      else:
+        continue
+
+      candidates = keys if candidates is None else candidates & keys
+      if not candidates:
+        return candidates
+
+    for name, (start, end) in bounds.iteritems():
+      index = self._property_indexes.get((app_kind, name))
+      keys = index and index.range(start, end) or set()
+      candidates = keys if candidates is None else candidates & keys
+
+    return candidates
+
+  def _GetQueryCursor(self, query, filters, orders, index_list):
+    app_ns = datastore_types.EncodeAppIdNamespace(query.app(),
+                                                  query.name_space())
+
+    if query.has_kind() and query.kind() in self._pseudo_kinds:
+      return super(MemoryDatastoreStub, self)._GetQueryCursor(
+          query, filters, orders, index_list)
+
+    self._entities_lock.acquire()
+    try:
+      if query.has_ancestor():
+        entity_group = datastore_stub_util._GetEntityGroup(query.ancestor())
+        eg_k = datastore_types.ReferenceToKeyValue(entity_group)
+        stored_entities = self._entities_by_group.get(eg_k, {}).values()
+        if query.has_kind():
+          kind = query.kind()
+          stored_entities = [
+              e for e in stored_entities
+              if datastore_file_stub._FinalElement(e.record.entity.key()).type()
+                  == kind]
+      elif query.has_kind():
+        app_kind = (app_ns, query.kind())
+        by_kind = self._entities_by_kind.get(app_kind, {})
+        keys = self._candidateKeys(app_kind, filters)
+        if keys is None:
+          stored_entities = by_kind.values()
+        else:
+          stored_entities = [by_kind[k] for k in keys if k in by_kind]
+      else:
+        stored_entities = []
+        for (cur_app_ns, _), entities in self._entities_by_kind.iteritems():
+          if cur_app_ns == app_ns:
+            stored_entities.extend(entities.itervalues())
+
+      results = [stored_entity.record for stored_entity in stored_entities]
+    finally:
+      self._entities_lock.release()
+
+    return datastore_stub_util._ExecuteQuery(results, query, filters, orders,
+                                             index_list)
@@ -21,6 +21,8 @@
 
 from soc.modules.seeder.logic.seeder import logic as seeder_logic
 
+from tests.seeder_utils import SeedGraph
+
 
 class ProfileHelper(object):
   """Helper class to aid in manipulating profile data.
@@ -116,6 +118,17 @@ class ProfileHelper(object):
   def createStudent(self):
     """Sets the current user to be a student for the current program.
     """
+    graph = SeedGraph()
+    self.addStudent(graph)
+    graph.put()
+    return self.profile
+
+  def addStudent(self, graph, override={}):
+    """Adds a student info for the current user to graph.
+
+    The profile is created first if it does not exist yet. It is updated
+    to refer to the student info and stored together with graph.
+    """
     pass
 
   def removeStudent(self):
@@ -255,8 +268,8 @@ class GSoCProfileHelper(ProfileHelper):
     self.profile.notify_private_comments = private_comments
     self.profile.put()
 
-  def createStudent(self):
-    """Sets the current user to be a student for the current program.
+  def addStudent(self, graph, override={}):
+    """Adds a student info for the current user to graph.
     """
     self.createProfile()
     from soc.modules.gsoc.models.profile import GSoCStudentInfo
@@ -265,9 +278,10 @@ class GSoCProfileHelper(ProfileHelper):
                   'number_of_projects': 0, 'number_of_proposals': 0,
                   'passed_evaluations': 0, 'failed_evaluations': 0,
                   'program': self.program}
-    self.profile.student_info = self.seed(GSoCStudentInfo, properties)
+    properties.update(override)
+    self.profile.student_info = graph.add(GSoCStudentInfo, properties)
     self.profile.is_student = True
-    self.profile.put()
+    graph.addEntity(self.profile)
     return self.profile
 
   def createStudentWithProposal(self, org, mentor):
@@ -280,9 +294,8 @@ class GSoCProfileHelper(ProfileHelper):
     """Sets the current user to be a student with specified number of 
     proposals for the current program.
     """
-    self.createStudent()
-    self.profile.student_info.number_of_proposals = n
-    self.profile.put()
+    graph = SeedGraph()
+    self.addStudent(graph, {'number_of_proposals': n})
     from soc.modules.gsoc.models.proposal import GSoCProposal
     properties = {
         'scope': self.profile, 'score': 0, 'nr_scores': 0,
@@ -291,7 +304,8 @@ class GSoCProfileHelper(ProfileHelper):
         'parent': self.profile, 'status': 'pending', 'has_mentor': True,
         'program': self.program, 'org': org, 'mentor': mentor
     }
-    self.seedn(GSoCProposal, properties, n)
+    graph.addn(GSoCProposal, properties, n)
+    graph.put()
     return self.profile
 
   def createStudentWithProject(self, org, mentor):
@@ -304,13 +318,13 @@ class GSoCProfileHelper(ProfileHelper):
     """Sets the current user to be a student with specified number of 
     projects for the current program.
     """
-    student = self.createStudent()
-    student.student_info.number_of_projects = n
-    student.student_info.put()
+    graph = SeedGraph()
+    self.addStudent(graph, {'number_of_projects': n})
     from soc.modules.gsoc.models.project import GSoCProject
     properties = {'program': self.program, 'org': org, 'status': 'accepted',
                   'parent': self.profile, 'mentors': [mentor.key()]}
-    self.seedn(GSoCProject, properties, n)
+    graph.addn(GSoCProject, properties, n)
+    graph.put()
     return self.profile
 
   def createMentorWithProject(self, org, student):
@@ -387,17 +401,18 @@ class GCIProfileHelper(ProfileHelper):
     self.profile.notify_comments = comments
     self.profile.put()
 
-  def createStudent(self):
-    """Sets the current user to be a student for the current program.
+  def addStudent(self, graph, override={}):
+    """Adds a student info for the current user to graph.
     """
     self.createProfile()
     from soc.modules.gci.models.profile import GCIStudentInfo
     properties = {'key_name': self.profile.key().name(), 'parent': self.profile,
                   'school': None, 'number_of_tasks_completed': 0,
                   'program': self.program}
-    self.profile.student_info = self.seed(GCIStudentInfo, properties)
+    properties.update(override)
+    self.profile.student_info = graph.add(GCIStudentInfo, properties)
     self.profile.is_student = True
-    self.profile.put()
+    graph.addEntity(self.profile)
     return self.profile
 
   def createStudentWithTask(self, status, org, mentor):
@@ -411,13 +426,11 @@ class GCIProfileHelper(ProfileHelper):
     tasks for the current program.
     """
     from tests.gci_task_utils import GCITaskHelper
-    student = self.createStudent()
-    student.student_info.put()
+    graph = SeedGraph()
+    student = self.addStudent(graph)
     gci_task_helper = GCITaskHelper(self.program)
-    tasks = []
-    for _ in xrange(n):
-        task = gci_task_helper.createTask(status, org, mentor, student)
-        tasks.append(task)
+    tasks = gci_task_helper.addTasks(graph, status, org, [mentor], student, n)
+    graph.put()
     return tasks
 
   def createMentorWithTask(self, status, org):
@@ -16,8 +16,14 @@
 
 
 
+import glob
+import inspect
+import pkgutil
 import sys
 import os
+import threading
+import time
+import unittest
 
 HERE = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
                                      '..'))
@@ -41,6 +47,36 @@ logging.disable(logging.INFO)
 log =  logging.getLogger('nose.plugins.cover')
 logging.disable(logging.INFO)
 
+# Number of test addresses sent to a worker per queue item
+DEFAULT_PROCESS_BATCH_SIZE = 4
+
+# File in which the durations of the tests are recorded, see load_durations
+DURATIONS_FILE = os.path.join(HERE, '.test_durations')
+
+# Packages imported up front by --preload, before any worker is forked
+PRELOAD_PACKAGES = [
+    'soc.logic', 'soc.models', 'soc.views',
+    'soc.modules.gsoc', 'soc.modules.gci', 'soc.modules.seeder',
+]
+
+# File in which the lines executed by each test are recorded
+IMPACT_FILE = os.path.join(HERE, '.test_impact')
+
+# Key prefix in IMPACT_FILE of the lines that define modules and classes
+IMPACT_DEFINITIONS_KEY = '<definitions>'
+
+# Key in IMPACT_FILE of the git revision at which the lines were recorded
+IMPACT_REVISION_KEY = '<revision>'
+
+# The ImpactTracer of this process if --record-impact is set
+_impact_tracer = None
+
+# Whether load_melange() has already been called in this process
+_melange_loaded = False
+
+# Whether all of PRELOAD_PACKAGES are imported when loading Melange
+_preload_melange = False
+
 
 def setup_gae_services():
   """Setups all google app engine services required for testing.
@@ -52,7 +88,6 @@ def setup_gae_services():
   from google.appengine.api.capabilities import capability_stub
   from google.appengine.api.memcache import memcache_stub
   from google.appengine.api.taskqueue import taskqueue_stub
-  from google.appengine.api import datastore_file_stub
   apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
   apiproxy_stub_map.apiproxy.RegisterStub(
       'urlfetch', urlfetch_stub.URLFetchServiceStub())
@@ -60,8 +95,7 @@ def setup_gae_services():
       'user', user_service_stub.UserServiceStub())
   apiproxy_stub_map.apiproxy.RegisterStub(
       'memcache', memcache_stub.MemcacheServiceStub())
-  apiproxy_stub_map.apiproxy.RegisterStub('datastore',
-      datastore_file_stub.DatastoreFileStub('test-app-run', None, None))
+  apiproxy_stub_map.apiproxy.RegisterStub('datastore', get_datastore_stub())
   apiproxy_stub_map.apiproxy.RegisterStub('mail', mail_stub.MailServiceStub())
   yaml_location = os.path.join(HERE, 'app')
   apiproxy_stub_map.apiproxy.RegisterStub(
@@ -70,6 +104,21 @@ def setup_gae_services():
       'capability_service', capability_stub.CapabilityServiceStub())
 
 
+def get_datastore_stub():
+  """Returns the datastore stub selected with --datastore.
+
+  The choice is passed through the environment so that it also applies
+  to the worker processes started by the multiprocess plugin.
+  """
+  datastore = os.environ.get('MELANGE_TEST_DATASTORE', 'file')
+  if datastore == 'memory':
+    from tests.memory_datastore_stub import MemoryDatastoreStub
+    return MemoryDatastoreStub('test-app-run')
+
+  from google.appengine.api import datastore_file_stub
+  return datastore_file_stub.DatastoreFileStub('test-app-run', None, None)
+
+
 def clean_datastore():
   from google.appengine.api import apiproxy_stub_map
   datastore = apiproxy_stub_map.apiproxy.GetStub('datastore')
@@ -78,6 +127,20 @@ def clean_datastore():
     datastore.Clear()
 
 
+def reset_clock():
+  from tests import clock_utils
+  # undo any clock frozen by the test helpers
+  clock_utils.setClock(clock_utils.Clock())
+
+
+def clean_memcache():
+  from google.appengine.api import apiproxy_stub_map
+  from google.appengine.api import memcache
+  # flush memcache iff one is available
+  if apiproxy_stub_map.apiproxy.GetStub('memcache') is not None:
+    memcache.flush_all()
+
+
 def begin(self):
   """Used to stub out nose.plugins.cover.Coverage.begin.
 
@@ -92,15 +155,63 @@ def begin(self):
     coverage.erase()
   coverage.exclude('#pragma[: ]+[nN][oO] [cC][oO][vV][eE][rR]')
   coverage.start()
+  start_melange()
+
+
+def start_melange():
+  """Loads Melange, preceded by importing all its modules if --preload is set.
+  """
+  if _preload_melange:
+    preload_melange()
+  else:
+    load_melange()
+
+
+def preload_melange():
+  """Imports all modules in PRELOAD_PACKAGES and loads Melange.
+
+  The multiprocess workers are forked from this process, so they share
+  the imported modules copy-on-write rather than importing them again on
+  first use. The time it took is written to stderr.
+  """
+  start = time.time()
+  count = len(sys.modules)
+
+  def onerror(name):
+    log.warning('Could not preload %s', name, exc_info=True)
+
+  for name in PRELOAD_PACKAGES:
+    try:
+      package = __import__(name, {}, {}, ['__path__'])
+    except ImportError:
+      onerror(name)
+      continue
+    for _, module_name, _ in pkgutil.walk_packages(
+        package.__path__, name + '.', onerror=onerror):
+      try:
+        __import__(module_name)
+      except Exception:
+        onerror(module_name)
+
+  imported = time.time()
   load_melange()
+  loaded = time.time()
+
+  sys.stderr.write('Imported %d modules in %.2fs, loaded Melange in %.2fs\n' %
+                   (len(sys.modules) - count, imported - start,
+                    loaded - imported))
 
 
 def load_melange():
   """Prepare Melange for usage.
 
   Registers a core, the GSoC and GCI modules, and calls the sitemap, sidebar
-  and rights services.
+  and rights services. This is done only once per process, workers forked
+  from a process that has already loaded Melange do not load it again.
   """
+  global _melange_loaded
+  if _melange_loaded:
+    return
 
   from soc.modules import callback
   from soc.modules.core import Core
@@ -118,10 +229,15 @@ def load_melange():
   current_core.callService('registerWithSitemap', True)
   current_core.callService('registerWithSidebar', True)
   current_core.callService('registerRights', True)
+  _melange_loaded = True
 
 
 class AppEngineDatastoreClearPlugin(plugins.Plugin):
   """Nose plugin to clear the AppEngine datastore between tests.
+
+  Memcache is flushed as well, so that values cached by one test, e.g. a
+  cached list page or a cached query result, are not seen by the next,
+  and the clock of the test helpers is reset to the real clock.
   """
   name = 'AppEngineDatastoreClearPlugin'
   enabled = True
@@ -134,13 +250,664 @@ class AppEngineDatastoreClearPlugin(plugins.Plugin):
 
   def afterTest(self, test):
     clean_datastore()
+    clean_memcache()
+    reset_clock()
+
+
+class RenderReportPlugin(plugins.Plugin):
+  """Nose plugin to report the time spent rendering Django templates.
+
+  Every render of a Django template, including the emails sent by the
+  tests, is timed, and the report lists the number of renders, bytes
+  rendered and bytes per second for each template. Times include the
+  templates rendered from within a template, while the totals only count
+  top level renders. It only covers the tests run in the main process.
+  """
+  name = 'render-report'
+  enabled = False
+
+  # the number of templates listed in the report
+  MAX_TEMPLATES = 20
+
+  def options(self, parser, env):
+    parser.add_option('--render-report', action='store_true',
+                      dest='render_report', default=False,
+                      help='Report the time spent rendering each template.')
+
+  def configure(self, options, conf):
+    self.conf = conf
+    self.enabled = getattr(options, 'render_report', False)
+    self.stats = {}
+    self.depth = 0
+    self.total_bytes = 0
+    self.total_seconds = 0.0
+
+  def begin(self):
+    from django.conf import settings
+    from django.template import Template
+    from mox import stubout
+    plugin = self
+    render = Template.render
+
+    def timed_render(template, context):
+      plugin.depth += 1
+      start = time.time()
+      try:
+        result = render(template, context)
+      finally:
+        plugin.depth -= 1
+      seconds = time.time() - start
+      # count the bytes of the response rather than unicode characters
+      if isinstance(result, unicode):
+        size = len(result.encode(settings.DEFAULT_CHARSET))
+      else:
+        size = len(result)
+      plugin.record(getattr(template, 'name', None), size, seconds)
+      return result
+
+    self.stubout = stubout.StubOutForTesting()
+    self.stubout.Set(Template, 'render', timed_render)
+
+  def record(self, name, size, seconds):
+    """Records a render of the template name of size bytes.
+    """
+    stats = self.stats.setdefault(name or '<unknown>', [0, 0, 0.0])
+    stats[0] += 1
+    stats[1] += size
+    stats[2] += seconds
+    if not self.depth:
+      self.total_bytes += size
+      self.total_seconds += seconds
+
+  def finalize(self, result):
+    self.stubout.UnsetAll()
+
+  def report(self, stream):
+    stream.writeln('Templates by render time:')
+    stream.writeln('  %-50s %8s %10s %8s %10s' % (
+        'template', 'renders', 'bytes', 'seconds', 'bytes/s'))
+    stats = sorted(self.stats.iteritems(), key=lambda item: -item[1][2])
+    for name, (renders, size, seconds) in stats[:self.MAX_TEMPLATES]:
+      stream.writeln('  %-50s %8d %10d %8.3f %10d' % (
+          name[-50:], renders, size, seconds, size / max(seconds, 1e-6)))
+    stream.writeln('Rendered %d bytes in %.3fs (%d bytes/s).' % (
+        self.total_bytes, self.total_seconds,
+        self.total_bytes / max(self.total_seconds, 1e-6)))
+
+
+def get_relative_path(path):
+  """Returns path relative to HERE, or None if it is not below HERE.
+  """
+  path = os.path.abspath(path)
+  if not path.startswith(HERE + os.sep):
+    return None
+  path = path[len(HERE) + 1:]
+  if path.endswith('.pyc') or path.endswith('.pyo'):
+    path = path[:-1]
+  return path
+
+
+def run_git(args):
+  """Runs git with args in HERE and returns its output.
+  """
+  import subprocess
+  process = subprocess.Popen(['git'] + args, cwd=HERE, stdout=subprocess.PIPE)
+  output = process.communicate()[0]
+  if process.returncode:
+    sys.exit('Could not run git %s' % ' '.join(args))
+  return output
+
+
+def get_revision(rev):
+  """Returns the commit id of the git revision rev.
+  """
+  return run_git(['rev-parse', '--verify', rev + '^{commit}']).strip()
+
+
+def get_changed_files(rev):
+  """Returns the set of files changed since rev, relative to HERE.
+
+  Both committed and uncommitted changes are included.
+  """
+  output = run_git(['diff', '--name-only', '--relative', rev])
+  return set(line for line in output.splitlines() if line)
+
+
+def get_changed_lines(rev):
+  """Returns the lines changed since rev, by file relative to HERE.
+
+  The lines are numbered as in rev. Where lines were only inserted, the
+  lines before and after the insertion count as changed.
+
+  Returns:
+    A dict mapping the path of each changed file to a set of line numbers.
+  """
+  output = run_git(['diff', '--unified=0', '--relative', rev])
+  changed = {}
+  lines = None
+  in_header = False
+  for line in output.splitlines():
+    if line.startswith('diff --git '):
+      in_header = True
+      lines = None
+    elif in_header and line.startswith('--- '):
+      path = line[4:]
+      if path.startswith('a/'):
+        lines = changed.setdefault(path[2:], set())
+    elif line.startswith('@@ '):
+      in_header = False
+      if lines is None:
+        continue
+      # @@ -start[,count] +start[,count] @@
+      old = line.split()[1][1:].split(',')
+      start = int(old[0])
+      count = 1
+      if len(old) > 1:
+        count = int(old[1])
+      if count:
+        lines.update(xrange(start, start + count))
+      else:
+        lines.update([start, start + 1])
+  return changed
+
+
+def format_lines(lines):
+  """Returns the lines dict as a string of path:ranges tokens.
+
+  Args:
+    lines: a dict mapping paths to sets of line numbers
+  """
+  tokens = []
+  for path, numbers in sorted(lines.iteritems()):
+    ranges = []
+    for number in sorted(numbers):
+      if ranges and ranges[-1][1] == number - 1:
+        ranges[-1][1] = number
+      else:
+        ranges.append([number, number])
+    tokens.append('%s:%s' % (path, ','.join(
+        start == end and str(start) or '%d-%d' % (start, end)
+        for start, end in ranges)))
+  return ' '.join(tokens)
+
+
+def touches_lines(value, changed_lines):
+  """Returns True iff the lines in value include any of changed_lines.
+
+  Args:
+    value: a string of path:ranges tokens, see format_lines
+    changed_lines: a dict mapping paths to sets of line numbers
+  """
+  for token in value.split():
+    path, ranges = token.rsplit(':', 1)
+    changed = changed_lines.get(path)
+    if not changed:
+      continue
+    for line_range in ranges.split(','):
+      bounds = line_range.split('-')
+      start, end = int(bounds[0]), int(bounds[-1])
+      for number in changed:
+        if start <= number <= end:
+          return True
+  return False
+
+
+class ImpactTracer(object):
+  """Line tracer which records the lines each test executes under HERE.
+
+  Files under thirdparty are not traced. Lines run outside of any test,
+  and lines run while a module or a class body executes, are recorded as
+  definitions instead. Those lines define module constants, model
+  properties and class attributes, which every test may read without
+  running them, e.g. because the module was imported by an earlier test.
+  """
+
+  def __init__(self):
+    self.paths = {}
+    self.definitions = {}
+    self.lines = None
+    self.defining = 0
+
+  def start(self):
+    """Starts tracing in this thread and in threads started from now on.
+    """
+    threading.settrace(self.trace)
+    sys.settrace(self.trace)
+
+  def start_test(self):
+    """Starts recording the lines of a test.
+    """
+    self.lines = {}
+
+  def stop_test(self):
+    """Stops recording the lines of a test and returns them by path.
+    """
+    lines = self.lines
+    self.lines = None
+    return lines or {}
+
+  def get_path(self, filename):
+    """Returns the path of the traced file filename, or None.
+    """
+    path = self.paths.get(filename, False)
+    if path is False:
+      # e.g. <string> for code compiled at run time has no file
+      path = None
+      if not filename.startswith('<'):
+        path = get_relative_path(filename)
+      if path is not None and path.startswith('thirdparty' + os.sep):
+        path = None
+      self.paths[filename] = path
+    return path
+
+  def trace(self, frame, event, arg):
+    path = self.get_path(frame.f_code.co_filename)
+    if path is None:
+      return None
+
+    # module and class bodies are the only code that is not optimized
+    if not frame.f_code.co_flags & inspect.CO_OPTIMIZED:
+      self.defining += 1
+      lines = self.definitions.setdefault(path, set())
+
+      def trace_definition(frame, event, arg):
+        if event == 'line':
+          lines.add(frame.f_lineno)
+        elif event == 'return':
+          self.defining -= 1
+        return trace_definition
+
+      return trace_definition
+
+    def trace_function(frame, event, arg):
+      if event == 'line':
+        if self.lines is None or self.defining:
+          lines = self.definitions
+        else:
+          lines = self.lines
+        lines.setdefault(path, set()).add(frame.f_lineno)
+      return trace_function
+
+    return trace_function
+
+
+def start_impact_tracer():
+  """Returns the ImpactTracer of this process, starting it if necessary.
+  """
+  global _impact_tracer
+  if _impact_tracer is None:
+    _impact_tracer = ImpactTracer()
+    _impact_tracer.start()
+  return _impact_tracer
+
+
+def save_impact_definitions(revision=None):
+  """Appends the definitions recorded by this process to its part file.
+
+  Args:
+    revision: if specified, it is recorded as the revision of the map
+  """
+  entries = {'%s.%d' % (IMPACT_DEFINITIONS_KEY, os.getpid()):
+                 format_lines(_impact_tracer.definitions)}
+  if revision:
+    entries[IMPACT_REVISION_KEY] = revision
+  save_history(entries, '%s.%d' % (IMPACT_FILE, os.getpid()), mode='a')
+
+
+class TestImpactPlugin(plugins.Plugin):
+  """Nose plugin to run only the tests that are affected by a change.
+
+  With --record-impact it records which lines of which files under HERE
+  are executed by each test, both of Melange and of the test helpers, and
+  the git revision they were recorded at. With --impacted-by=REV it skips
+  all tests which did not execute any of the lines changed since the git
+  revision REV. Tests that were not recorded yet, or whose own file
+  changed, are always run.
+
+  The whole suite is run instead if the map was recorded at another
+  revision than REV, or if a changed line belongs to the definitions, see
+  ImpactTracer. It is also run if a file other than a Python module
+  changed, e.g. a template, since those are not traced. Tests are only
+  selected in the main process, worker processes merely record the lines.
+
+  Recording traces every line, like coverage does, so it cannot be
+  combined with --coverage. The map is only valid for the revision it was
+  recorded at, so recording at another revision starts a new map.
+  """
+  name = 'test-impact'
+  enabled = False
+
+  def options(self, parser, env):
+    parser.add_option('--record-impact', action='store_true',
+                      dest='record_impact', default=False,
+                      help='Record the lines executed by each test '
+                           'in %s.' % IMPACT_FILE)
+    parser.add_option('--impacted-by', action='store', dest='impacted_by',
+                      default=None, metavar='REV',
+                      help='Only run the tests that executed lines changed '
+                           'since the git revision REV.')
+
+  def configure(self, options, conf):
+    self.conf = conf
+    self.record = getattr(options, 'record_impact', False)
+    self.impacted_by = getattr(options, 'impacted_by', None)
+    self.enabled = bool(self.record or self.impacted_by)
+    if not self.enabled:
+      return
+
+    self.tracer = None
+    self.revision = None
+    worker = getattr(conf, 'worker', False)
+
+    # tests are selected when they are collected by the main process, the
+    # workers must not touch the part files other workers are writing to
+    if worker:
+      self.impacted_by = None
+
+    if self.impacted_by:
+      self.configureSelection()
+
+    if self.record:
+      self.tracer = start_impact_tracer()
+      if not worker:
+        self.revision = get_revision('HEAD')
+        history = load_history(IMPACT_FILE)
+        if history.get(IMPACT_REVISION_KEY) != self.revision:
+          for path in glob.glob(IMPACT_FILE + '*'):
+            os.remove(path)
+
+  def configureSelection(self):
+    """Loads the recorded map and the changes since impacted_by.
+    """
+    self.changed = get_changed_files(self.impacted_by)
+    self.changed_lines = get_changed_lines(self.impacted_by)
+    self.impact = load_history(IMPACT_FILE)
+    self.run_all = True
+
+    definitions = {}
+    for key, value in self.impact.iteritems():
+      if key.startswith(IMPACT_DEFINITIONS_KEY):
+        definitions[key] = value
+
+    if (self.impact.get(IMPACT_REVISION_KEY) !=
+        get_revision(self.impacted_by)):
+      reason = 'the impact was not recorded at %s' % self.impacted_by
+    elif [path for path in self.changed if not path.endswith('.py')]:
+      reason = 'files other than Python modules changed'
+    elif [path for path in self.changed
+          if path.startswith('thirdparty' + os.sep)]:
+      reason = 'files under thirdparty changed'
+    elif [value for value in definitions.itervalues()
+          if touches_lines(value, self.changed_lines)]:
+      reason = 'module or class definitions changed'
+    else:
+      self.run_all = False
+      return
+    sys.stderr.write('Running all tests: %s.\n' % reason)
+
+  def startTest(self, test):
+    if self.tracer:
+      self.tracer.start_test()
+
+  def stopTest(self, test):
+    if not self.tracer:
+      return
+    lines = self.tracer.stop_test()
+    save_history({test.id(): format_lines(lines)},
+                 '%s.%d' % (IMPACT_FILE, os.getpid()), mode='a')
+
+  def finalize(self, result):
+    # the workers save their definitions when they end
+    if self.tracer and not getattr(self.conf, 'worker', False):
+      save_impact_definitions(self.revision)
+
+  def isImpacted(self, test_id, module):
+    """Returns True iff the test with test_id in module should be run.
+    """
+    if self.run_all:
+      return True
+    lines = self.impact.get(test_id)
+    if lines is None:
+      return True
+    test_file = get_relative_path(getattr(module, '__file__', ''))
+    return test_file in self.changed or touches_lines(lines,
+                                                      self.changed_lines)
+
+
+  def wantMethod(self, method):
+    if not self.impacted_by:
+      return None
+    cls = method.im_class
+    test_id = '%s.%s.%s' % (cls.__module__, cls.__name__, method.__name__)
+    if not self.isImpacted(test_id, sys.modules.get(cls.__module__)):
+      return False
+    return None
+
+  def wantFunction(self, function):
+    if not self.impacted_by:
+      return None
+    test_id = '%s.%s' % (function.__module__, function.__name__)
+    if not self.isImpacted(test_id, sys.modules.get(function.__module__)):
+      return False
+    return None
+
+
+def get_duration_key(test_addr):
+  """Returns the key under which the duration of test_addr is recorded.
+
+  Test addresses start with the absolute path of the test file, which is
+  made relative so that the recorded durations survive moving the checkout.
+  """
+  if test_addr.startswith(HERE):
+    return test_addr[len(HERE):].lstrip(os.sep)
+  return test_addr
+
+
+def load_history(path):
+  """Returns a dict with the entries of the history file at path.
+
+  Each line of a history file holds a key and a value separated by a tab.
+  Worker processes record their entries in separate files named path.<pid>,
+  these are merged into path and removed. The part files are merged in the
+  order they were written, so the entries of the latest run win, whatever
+  the pids of its workers.
+  """
+  entries = {}
+  part_files = glob.glob(path + '.*')
+  part_files.sort(key=os.path.getmtime)
+  for file_path in [path] + part_files:
+    try:
+      history = open(file_path)
+    except IOError:
+      continue
+    try:
+      for line in history:
+        try:
+          key, value = line.rstrip('\n').split('\t', 1)
+          entries[key] = value
+        except ValueError:
+          log.debug('Ignoring malformed line in %s: %r', file_path, line)
+    finally:
+      history.close()
+
+  if part_files:
+    save_history(entries, path)
+    for file_path in part_files:
+      os.remove(file_path)
+
+  return entries
+
+
+def save_history(entries, path, mode='w'):
+  """Writes the entries dict to the history file at path.
+
+  Args:
+    entries: a dict mapping keys to string values
+    path: the path of the history file
+    mode: 'w' to overwrite the file or 'a' to append to it
+  """
+  history = open(path, mode)
+  try:
+    for key, value in sorted(entries.iteritems()):
+      history.write('%s\t%s\n' % (key, value))
+  finally:
+    history.close()
+
+
+def load_durations():
+  """Returns a dict with the recorded duration of every test.
+  """
+  durations = {}
+  for key, value in load_history(DURATIONS_FILE).iteritems():
+    try:
+      durations[key] = float(value)
+    except ValueError:
+      log.debug('Ignoring malformed duration for %s: %r', key, value)
+  return durations
+
+
+def save_durations(durations, path):
+  """Writes the durations dict to the history file at path.
+  """
+  save_history(dict((key, '%.3f' % duration)
+                    for key, duration in durations.iteritems()), path)
+
+
+class BatchingTestQueue(object):
+  """Queue wrapper which puts items on the wrapped queue in batches.
+
+  Items are held back until flush() is called. If the durations of an
+  earlier run are known, the longest tests are queued first so that no
+  worker is left with a slow test at the end of the run (LPT scheduling).
+  Batches are then formed so that no batch is expected to take longer
+  than the longest test, which keeps slow tests in batches of their own.
+  """
+
+  def __init__(self, queue, size, durations=None):
+    self.queue = queue
+    self.size = size
+    self.durations = durations or {}
+    self.pending = []
+
+    if self.durations:
+      self.default_duration = (sum(self.durations.itervalues()) /
+                               len(self.durations))
+    else:
+      self.default_duration = 0.0
+
+  def put(self, item, block=True, timeout=None):
+    self.pending.append(item)
+
+  def estimate(self, item):
+    """Returns the expected duration of the (test_addr, arg) item.
+
+    Tests without a recorded duration are expected to take average time.
+    """
+    test_addr, arg = item
+    if arg is not None:
+      test_addr = test_addr + str(arg)
+    key = get_duration_key(test_addr)
+    return self.durations.get(key, self.default_duration)
+
+  def flush(self):
+    """Puts all pending items on the wrapped queue as lists of items.
+    """
+    items = self.pending
+    self.pending = []
+    if not items:
+      return
+
+    estimates = [self.estimate(item) for item in items]
+    scheduled = zip(estimates, items)
+    # a stable sort keeps the collection order of tests with equal estimates
+    scheduled.sort(key=lambda s: -s[0])
+    limit = scheduled[0][0]
+
+    batch = []
+    batch_duration = 0.0
+    for duration, item in scheduled:
+      if batch and (len(batch) >= self.size or
+                    batch_duration + duration > limit):
+        self.queue.put(batch, block=False)
+        batch = []
+        batch_duration = 0.0
+      batch.append(item)
+      batch_duration += duration
+    self.queue.put(batch, block=False)
+
+
+class UnrunTestsCheck(unittest.TestCase):
+  """Reports the queued tests for which no worker returned a result.
+
+  A worker that does not react to the timeout signal is terminated and
+  the rest of its batch is lost with it. The runner tears this check down
+  together with the shared fixtures once all results are in, so that the
+  lost tests are reported as an error instead of silently missing.
+  """
+
+  def __init__(self, tasks, result, config):
+    unittest.TestCase.__init__(self)
+    self.tasks = tasks
+    self.result = result
+    self.config = config
+
+  def __str__(self):
+    return 'Unrun tests'
+
+  def runTest(self):
+    pass
+
+  def tearDown(self):
+    # the remaining tests are skipped on purpose after a failure with -x
+    if self.config.stopOnError and not self.result.wasSuccessful():
+      return
+    if self.tasks:
+      raise RuntimeError('%d tests were not run because their worker was '
+                         'terminated:\n%s' % (len(self.tasks),
+                                              '\n'.join(self.tasks)))
+
+
+def get_batched_collect(collect, size, durations):
+  """Returns a replacement for MultiProcessTestRunner.collect.
+
+  The returned function queues the test addresses in batches of size, so
+  that a worker needs a single queue round-trip per batch instead of per
+  test, and orders them by their recorded durations. The workers unpack
+  the batches again, see multiprocess_runner. Tests lost with a
+  terminated worker are reported by an UnrunTestsCheck.
+
+  Args:
+    collect: the original MultiProcessTestRunner.collect
+    size: the maximum number of test addresses per batch
+    durations: a dict with recorded test durations, see load_durations
+  """
+
+  def batched_collect(self, test, testQueue, tasks, to_teardown, result):
+    # collect calls itself for suites with shared fixtures
+    if isinstance(testQueue, BatchingTestQueue):
+      return collect(self, test, testQueue, tasks, to_teardown, result)
+
+    # a worker restarts after each item, so it must only get one test
+    if self.config.multiprocess_restartworker:
+      batching_queue = BatchingTestQueue(testQueue, 1, durations)
+    else:
+      batching_queue = BatchingTestQueue(testQueue, size, durations)
+    collect(self, test, batching_queue, tasks, to_teardown, result)
+    batching_queue.flush()
+    if tasks is not None:
+      to_teardown.append(UnrunTestsCheck(tasks, result, self.config))
+
+  return batched_collect
 
 
 def multiprocess_runner(ix, testQueue, resultQueue, currentaddr, currentstart,
            keyboardCaught, shouldStop, loaderClass, resultClass, config):
   """To replace the test runner of multiprocess.
 
-  * Setup gae services at the beginning of every process
+  * Setup gae services and load Melange at the beginning of every process
+  * Accept batches of tests, see get_batched_collect
+  * Record the duration of each test, see load_durations
+  * Record the definitions traced by the worker, see ImpactTracer
   * Clean datastore after each test
   """
   from nose import failure
@@ -154,6 +921,8 @@ def multiprocess_runner(ix, testQueue, resultQueue, currentaddr, currentstart,
   from nose.plugins.multiprocess import _instantiate_plugins, \
     NoSharedFixtureContextSuite, _WritelnDecorator, TestLet
   config = pickle.loads(config)
+  # lets the plugins tell that they run in a worker
+  config.worker = True
   dummy_parser = config.parserClass()
   if _instantiate_plugins is not None:
     for pluginclass in _instantiate_plugins:
@@ -169,6 +938,16 @@ def multiprocess_runner(ix, testQueue, resultQueue, currentaddr, currentstart,
   def get():
     return testQueue.get(timeout=config.multiprocess_timeout)
 
+  def get_tests():
+    """Yields the (test_addr, arg) pairs from the queue, unpacking batches.
+    """
+    for item in iter(get, 'STOP'):
+      if isinstance(item, list):
+        for test in item:
+          yield test
+      else:
+        yield item
+
   def makeResult():
     stream = _WritelnDecorator(StringIO())
     result = resultClass(stream, descriptions=1,
@@ -197,61 +976,79 @@ def multiprocess_runner(ix, testQueue, resultQueue, currentaddr, currentstart,
     """Runs just after the process starts to setup services.
     """
     setup_gae_services()
+    load_melange()
 
   def after_each_test():
-    """Runs after each test to clean datastore.
+    """Runs after each test to clean datastore and memcache.
     """
     clean_datastore()
+    clean_memcache()
+    reset_clock()
 
-  # Setup gae services at the beginning of every process
-  setup_process_env()
-  for test_addr, arg in iter(get, 'STOP'):
-    if shouldStop.is_set():
-      log.exception('Worker %d STOPPED',ix)
-      break
-    result = makeResult()
-    test = loader.loadTestsFromNames([test_addr])
-    test.testQueue = testQueue
-    test.tasks = []
-    test.arg = arg
-    log.debug("Worker %s Test is %s (%s)", ix, test_addr, test)
-    try:
-      if arg is not None:
-        test_addr = test_addr + str(arg)
-      currentaddr.value = bytes_(test_addr)
-      currentstart.value = time.time()
-      test(result)
-      currentaddr.value = bytes_('')
-      resultQueue.put((ix, test_addr, test.tasks, batch(result)))
-      # Clean datastore after each test
-      after_each_test()
-    except KeyboardInterrupt:
-      keyboardCaught.set()
-      if len(currentaddr.value) > 0:
-        log.exception('Worker %s keyboard interrupt, failing '
-                'current test %s',ix,test_addr)
+  def run_tests(durations):
+    """Runs the tests from the queue, recording their durations.
+    """
+    for test_addr, arg in get_tests():
+      if shouldStop.is_set():
+        log.exception('Worker %d STOPPED',ix)
+        break
+      result = makeResult()
+      test = loader.loadTestsFromNames([test_addr])
+      test.testQueue = testQueue
+      test.tasks = []
+      test.arg = arg
+      log.debug("Worker %s Test is %s (%s)", ix, test_addr, test)
+      try:
+        if arg is not None:
+          test_addr = test_addr + str(arg)
+        currentaddr.value = bytes_(test_addr)
+        currentstart.value = time.time()
+        test(result)
+        durations[get_duration_key(test_addr)] = (
+            time.time() - currentstart.value)
         currentaddr.value = bytes_('')
-        failure.Failure(*sys.exc_info())(result)
         resultQueue.put((ix, test_addr, test.tasks, batch(result)))
-      else:
-        log.debug('Worker %s test %s timed out',ix,test_addr)
+        # Clean datastore after each test
+        after_each_test()
+      except KeyboardInterrupt:
+        keyboardCaught.set()
+        if len(currentaddr.value) > 0:
+          log.exception('Worker %s keyboard interrupt, failing '
+                  'current test %s',ix,test_addr)
+          currentaddr.value = bytes_('')
+          failure.Failure(*sys.exc_info())(result)
+          resultQueue.put((ix, test_addr, test.tasks, batch(result)))
+        else:
+          log.debug('Worker %s test %s timed out',ix,test_addr)
+          resultQueue.put((ix, test_addr, test.tasks, batch(result)))
+      except SystemExit:
+        currentaddr.value = bytes_('')
+        log.exception('Worker %s system exit',ix)
+        raise
+      except:
+        currentaddr.value = bytes_('')
+        log.exception("Worker %s error running test or returning "
+                      "results",ix)
+        failure.Failure(*sys.exc_info())(result)
         resultQueue.put((ix, test_addr, test.tasks, batch(result)))
-    except SystemExit:
-      currentaddr.value = bytes_('')
-      log.exception('Worker %s system exit',ix)
-      raise
-    except:
-      currentaddr.value = bytes_('')
-      log.exception("Worker %s error running test or returning "
-                    "results",ix)
-      failure.Failure(*sys.exc_info())(result)
-      resultQueue.put((ix, test_addr, test.tasks, batch(result)))
-    if config.multiprocess_restartworker:
-      break
+      if config.multiprocess_restartworker:
+        break
+
+  # Setup gae services at the beginning of every process
+  setup_process_env()
+  durations = {}
+  try:
+    run_tests(durations)
+  finally:
+    if durations:
+      save_durations(durations, '%s.%d' % (DURATIONS_FILE, os.getpid()))
+    if _impact_tracer is not None:
+      save_impact_definitions()
   log.debug("Worker %s ending", ix)
 
 
 def main():
+  global _preload_melange
   sys.path = extra_paths + sys.path
   os.environ['SERVER_SOFTWARE'] = 'Development via nose'
   os.environ['SERVER_NAME'] = 'Foo'
@@ -261,13 +1058,44 @@ def main():
   os.environ['USER_ID'] = '42'
   os.environ['CURRENT_VERSION_ID'] = 'testing-version'
   os.environ['HTTP_HOST'] = 'some.testing.host.tld'
+
+  # For the datastore stub, either --datastore=file (default) or memory
+  for arg in sys.argv[1:]:
+    if arg.startswith('--datastore='):
+      datastore = arg.split('=', 1)[1]
+      if datastore not in ['file', 'memory']:
+        sys.exit('Unknown datastore stub: %s' % datastore)
+      os.environ['MELANGE_TEST_DATASTORE'] = datastore
+      sys.argv.remove(arg)
+      break
+
+  # For multiprocess, the number of tests sent to a worker at once
+  batch_size = DEFAULT_PROCESS_BATCH_SIZE
+  for arg in sys.argv[1:]:
+    if arg.startswith('--process-batch-size='):
+      batch_size = int(arg.split('=', 1)[1])
+      sys.argv.remove(arg)
+      break
+
+  # For importing all of Melange before forking any worker
+  if '--preload' in sys.argv:
+    _preload_melange = True
+    sys.argv.remove('--preload')
+
+  # For recording the impact, the lines that define Melange are traced too
+  if '--record-impact' in sys.argv:
+    if '--coverage' in sys.argv:
+      sys.exit('--record-impact cannot be combined with --coverage')
+    start_impact_tracer()
+
   setup_gae_services()
 
   import main as app_main
   import django.test.utils
   django.test.utils.setup_test_environment()
 
-  plugins = [AppEngineDatastoreClearPlugin()]
+  plugins = [AppEngineDatastoreClearPlugin(), TestImpactPlugin(),
+             RenderReportPlugin()]
   # For coverage
   if '--coverage' in sys.argv:
     from nose.plugins import cover
@@ -286,7 +1114,7 @@ def main():
     sys.argv.remove('--coverage')
     sys.argv += args
   else:
-    load_melange()
+    start_melange()
 
   # For multiprocess
   will_multiprocess = False
@@ -299,6 +1127,13 @@ def main():
     from nose.plugins import multiprocess
     stubout_obj = stubout.StubOutForTesting()
     stubout_obj.SmartSet(multiprocess, '__runner', multiprocess_runner)
+    # Workers only get the plugins listed here, they record the impact
+    stubout_obj.Set(multiprocess, '_instantiate_plugins',
+                    [TestImpactPlugin])
+    runner_class = multiprocess.MultiProcessTestRunner
+    stubout_obj.SmartSet(runner_class, 'collect',
+                         get_batched_collect(runner_class.collect.im_func,
+                                             batch_size, load_durations()))
     # The default --process-timeout (10s) is too short
     sys.argv += ['--process-timeout=300']
 
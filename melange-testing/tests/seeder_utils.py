@@ -0,0 +1,103 @@
+#!/usr/bin/env python2.5
+#
+# Copyright 2012 the Melange authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Utils for seeding graphs of entities in a single batch.
+"""
+
+
+from google.appengine.ext import db
+
+from soc.modules.seeder.logic.seeder import logic as seeder_logic
+
+
+class SeedGraph(object):
+  """Graph of entities which are seeded in memory and stored at once.
+
+  Entities are added to the graph with add() or addn(), which return
+  unsaved model instances that already have a complete key, so they can
+  be referenced by, or be the parent of, entities added afterwards.
+  Nothing is written until put() is called, which stores the whole graph
+  with a single batched db.put().
+  """
+
+  def __init__(self):
+    """Initializes the SeedGraph.
+    """
+    self.entities = []
+
+  def _seedProperties(self, model, properties,
+                      auto_seed_optional_properties=True):
+    return seeder_logic.seed_properties(model, properties, recurse=False,
+        auto_seed_optional_properties=auto_seed_optional_properties)
+
+  def _allocateKeys(self, model, parent, n):
+    """Returns n new complete keys for model under parent.
+    """
+    if isinstance(parent, db.Model):
+      parent = parent.key()
+    template = db.Key.from_path(model.kind(), 1, parent=parent)
+    start, end = db.allocate_ids(template, n)
+    return [db.Key.from_path(model.kind(), i, parent=parent)
+            for i in xrange(start, end + 1)]
+
+  def addEntity(self, entity):
+    """Adds an existing entity to the graph so that it is stored by put().
+    """
+    for other in self.entities:
+      if other is entity:
+        return entity
+    self.entities.append(entity)
+    return entity
+
+  def add(self, model, properties, auto_seed_optional_properties=True):
+    """Adds an entity of model seeded with properties to the graph.
+    """
+    return self.addn(model, properties, 1,
+        auto_seed_optional_properties=auto_seed_optional_properties)[0]
+
+  def addn(self, model, properties, n, auto_seed_optional_properties=True):
+    """Adds n entities of model seeded with properties to the graph.
+
+    Entities without a key_name get an id allocated right away, with one
+    call for all n of them.
+    """
+    seeded = [self._seedProperties(model, properties,
+                  auto_seed_optional_properties=auto_seed_optional_properties)
+              for _ in xrange(n)]
+
+    entities = []
+    if seeded[0].get('key_name'):
+      for entity_properties in seeded:
+        entities.append(model(**entity_properties))
+    else:
+      parent = seeded[0].get('parent')
+      keys = self._allocateKeys(model, parent, n)
+      for key, entity_properties in zip(keys, seeded):
+        entity_properties.pop('parent', None)
+        entity_properties.pop('key_name', None)
+        entities.append(model(key=key, **entity_properties))
+
+    self.entities.extend(entities)
+    return entities
+
+  def put(self):
+    """Stores all entities in the graph with a single batched put.
+    """
+    db.put(self.entities)
+    entities = self.entities
+    self.entities = []
+    return entities
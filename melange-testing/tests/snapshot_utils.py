@@ -0,0 +1,72 @@
+#!/usr/bin/env python2.5
+#
+# Copyright 2012 the Melange authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Utils for snapshotting and restoring datastore fixtures.
+"""
+
+
+from google.appengine.api import datastore
+from google.appengine.ext import db
+
+
+def isDatastoreEmpty():
+  """Returns True iff there are no entities stored in the datastore.
+  """
+  return not datastore.Query(keys_only=True).Get(1)
+
+
+class DatastoreSnapshot(object):
+  """Copy of all entities in the datastore at a given moment.
+
+  A snapshot is captured once, after the fixtures have been seeded, and
+  can then be restored into an empty datastore with a single batched put
+  instead of seeding the same entities over and over again.
+  """
+
+  def __init__(self, entities, keys):
+    """Initializes the DatastoreSnapshot.
+
+    Args:
+      entities: a list of datastore.Entity instances to snapshot
+      keys: a dict mapping names to the keys of the entities which
+          should be returned as models by restore()
+    """
+    self.entity_pbs = [entity.ToPb() for entity in entities]
+    self.keys = dict(keys)
+
+  @classmethod
+  def capture(cls, keys):
+    """Returns a snapshot of all entities currently in the datastore.
+
+    Args:
+      keys: a dict mapping names to the keys of the entities which
+          should be returned as models by restore()
+    """
+    return cls(datastore.Query().Run(), keys)
+
+  def restore(self):
+    """Writes the entities of this snapshot back to the datastore.
+
+    Returns:
+      A dict mapping each name in self.keys to a fresh model instance.
+    """
+    entities = [datastore.Entity.FromPb(pb) for pb in self.entity_pbs]
+    datastore.Put(entities)
+
+    names = self.keys.keys()
+    models = db.get([self.keys[name] for name in names])
+    return dict(zip(names, models))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python2.5
+#
+# Copyright 2012 the Melange authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the clock used by the test helpers.
+"""
+
+
+import datetime
+
+from tests import clock_utils
+from tests import timeline_utils
+from tests.gci_task_utils import GCITaskHelper
+from tests.profile_utils import GCIProfileHelper
+from tests.test_utils import GCITestCase
+
+
+class ClockUtilsTest(GCITestCase):
+  """Tests that the test helpers take their dates from the frozen clock.
+  """
+
+  def setUp(self):
+    self.init()
+    self.now = datetime.datetime(2012, 6, 1, 12)
+
+  def testInitResetsClock(self):
+    """Tests that init() replaces a frozen clock with the real clock.
+    """
+    self.freezeClock(self.now)
+    self.init()
+    self.assertFalse(isinstance(clock_utils.getClock(),
+                                clock_utils.FrozenClock))
+
+  def testPastAndFuture(self):
+    """Tests that past() and future() follow the frozen clock as it advances.
+    """
+    clock = self.freezeClock(self.now)
+    self.assertEqual(self.now - datetime.timedelta(100), timeline_utils.past())
+    self.assertEqual(self.now + datetime.timedelta(3),
+                     timeline_utils.future(delta=3))
+
+    later = clock.advance(days=2)
+    self.assertEqual(self.now + datetime.timedelta(2), later)
+    self.assertEqual(later, clock_utils.now())
+    self.assertEqual(later - datetime.timedelta(1),
+                     timeline_utils.past(delta=1))
+    self.assertEqual(later + datetime.timedelta(100), timeline_utils.future())
+
+  def testAdvanceBackwards(self):
+    """Tests that a frozen clock refuses to move backwards.
+    """
+    clock = self.freezeClock(self.now)
+    self.assertRaises(ValueError, clock.advance, days=-1)
+    self.assertEqual(self.now, clock.now())
+
+  def testTaskDates(self):
+    """Tests that GCITaskHelper dates the tasks by the frozen clock.
+    """
+    clock = self.freezeClock(self.now)
+    mentor = GCIProfileHelper(self.gci, self.dev_test).createOtherUser(
+        'mentor@example.com').createMentor(self.org)
+    task_helper = GCITaskHelper(self.gci)
+
+    task = task_helper.createTask('Open', self.org, mentor)
+    self.assertEqual(self.now - datetime.timedelta(20), task.created_on)
+
+    clock.advance(days=5)
+    task = task_helper.createTask('Open', self.org, mentor)
+    self.assertEqual(self.now - datetime.timedelta(15), task.created_on)
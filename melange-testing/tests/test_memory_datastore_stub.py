@@ -0,0 +1,198 @@
+#!/usr/bin/env python2.5
+#
+# Copyright 2012 the Melange authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the in-memory datastore stub used by the test runner.
+"""
+
+
+import unittest
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import datastore_file_stub
+from google.appengine.ext import db
+
+from tests.memory_datastore_stub import MemoryDatastoreStub
+
+
+class MemoryStubTestModel(db.Model):
+  """Model used to compare the results of the datastore stubs.
+  """
+  n = db.IntegerProperty()
+  tags = db.StringListProperty()
+
+
+class MemoryStubChildModel(db.Model):
+  """Model of the children of MemoryStubTestModel entities.
+  """
+  n = db.IntegerProperty()
+
+
+class MemoryDatastoreStubTest(unittest.TestCase):
+  """Tests that MemoryDatastoreStub returns the same results as the file stub.
+  """
+
+  def setUp(self):
+    self.apiproxy = apiproxy_stub_map.apiproxy
+
+  def tearDown(self):
+    apiproxy_stub_map.apiproxy = self.apiproxy
+
+  def useStub(self, stub):
+    """Makes stub the datastore stub and stores the test entities.
+
+    Ten MemoryStubTestModel entities with n from 0 to 9 are stored, the
+    first of which has two children of each model with n 100 and 101.
+
+    Returns:
+      The keys of the ten MemoryStubTestModel entities, ordered by n.
+    """
+    apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+    apiproxy_stub_map.apiproxy.RegisterStub('datastore_v3', stub)
+    entities = []
+    for i in xrange(10):
+      tags = [i % 2 and 'odd' or 'even', i < 5 and 'small' or 'big']
+      entities.append(
+          MemoryStubTestModel(key_name='key%02d' % i, n=i, tags=tags))
+    db.put(entities)
+
+    children = []
+    for model in [MemoryStubTestModel, MemoryStubChildModel]:
+      for i in xrange(2):
+        children.append(model(parent=entities[0],
+                              key_name='child%02d' % i, n=100 + i))
+    db.put(children)
+    return [entity.key() for entity in entities]
+
+  def compareStubs(self, run_queries):
+    """Runs the queries with both stubs and checks that the results match.
+
+    Args:
+      run_queries: a function which takes the keys returned by useStub
+          and returns a list of query results
+
+    Returns:
+      The results of the queries with MemoryDatastoreStub.
+    """
+    expected = run_queries(self.useStub(
+        datastore_file_stub.DatastoreFileStub('test-app-run', None, None)))
+    actual = run_queries(self.useStub(MemoryDatastoreStub('test-app-run')))
+    self.assertEqual(expected, actual)
+    return actual
+
+  def testKeyFilters(self):
+    """Tests that queries with __key__ filters match those of the file stub.
+    """
+    def run_queries(keys):
+      queries = [
+          MemoryStubTestModel.all().filter('__key__ =', keys[3]),
+          MemoryStubTestModel.all().filter('__key__ >=', keys[2]),
+          MemoryStubTestModel.all().filter('__key__ >', keys[2]).filter(
+              '__key__ <=', keys[5]),
+          MemoryStubTestModel.all().filter('__key__ >=', keys[2]).filter(
+              'n', 6),
+          MemoryStubTestModel.all().filter('n', 4),
+      ]
+      return [sorted(entity.n for entity in query) for query in queries]
+
+    actual = self.compareStubs(run_queries)
+    self.assertEqual(
+        [[3], range(2, 10), [3, 4, 5], [6], [4]], actual)
+
+  def testAncestorQueries(self):
+    """Tests that ancestor queries with a kind match those of the file stub.
+    """
+    def run_queries(keys):
+      queries = [
+          MemoryStubTestModel.all().ancestor(keys[0]),
+          MemoryStubChildModel.all().ancestor(keys[0]),
+          MemoryStubTestModel.all().ancestor(keys[0]).filter('n >', 0),
+          MemoryStubTestModel.all().ancestor(keys[1]),
+      ]
+      return [sorted(entity.n for entity in query) for query in queries]
+
+    actual = self.compareStubs(run_queries)
+    self.assertEqual([[0, 100, 101], [100, 101], [100, 101], [1]], actual)
+
+  def testInequalitiesWithOrders(self):
+    """Tests that inequality filters with sort orders match the file stub.
+    """
+    def run_queries(keys):
+      queries = [
+          MemoryStubChildModel.all().filter('n >', 100).order('-n'),
+          MemoryStubTestModel.all().filter('n >', 3).filter(
+              'n <', 100).order('-n'),
+          MemoryStubTestModel.all().filter('n >=', 2).filter(
+              'n <', 7).order('n'),
+          MemoryStubTestModel.all().filter('tags', 'odd').filter(
+              'n <', 6).order('-n'),
+      ]
+      return [[entity.n for entity in query] for query in queries]
+
+    actual = self.compareStubs(run_queries)
+    self.assertEqual([[101], [9, 8, 7, 6, 5, 4], [2, 3, 4, 5, 6], [5, 3, 1]],
+                     actual)
+
+  def testListProperties(self):
+    """Tests that filters on list properties match those of the file stub.
+    """
+    def run_queries(keys):
+      queries = [
+          MemoryStubTestModel.all().filter('tags', 'even'),
+          MemoryStubTestModel.all().filter('tags', 'even').filter(
+              'tags', 'small'),
+          MemoryStubTestModel.all().filter('tags', 'none'),
+          MemoryStubTestModel.all().filter('tags >', 'odd'),
+      ]
+      return [sorted(entity.n for entity in query) for query in queries]
+
+    actual = self.compareStubs(run_queries)
+    self.assertEqual([[0, 2, 4, 6, 8], [0, 2, 4], [], [0, 1, 2, 3, 4]],
+                     actual)
+
+  def testCountLimitAndOffset(self):
+    """Tests that count(), fetch() limits and offsets match the file stub.
+    """
+    def run_queries(keys):
+      query = MemoryStubTestModel.all().filter('n <', 100).order('n')
+      return [
+          query.count(),
+          MemoryStubTestModel.all().filter('tags', 'odd').count(),
+          MemoryStubTestModel.all().filter('n <', 100).count(limit=3),
+          [entity.n for entity in query.fetch(3)],
+          [entity.n for entity in query.fetch(3, offset=8)],
+      ]
+
+    actual = self.compareStubs(run_queries)
+    self.assertEqual([10, 5, 3, [0, 1, 2], [8, 9]], actual)
+
+  def testCursors(self):
+    """Tests that paging through a query with cursors matches the file stub.
+    """
+    def run_queries(keys):
+      pages = []
+      cursor = None
+      while True:
+        query = MemoryStubTestModel.all().filter('n <', 100).order('-n')
+        if cursor:
+          query.with_cursor(cursor)
+        page = query.fetch(4)
+        if not page:
+          return pages
+        pages.append([entity.n for entity in page])
+        cursor = query.cursor()
+
+    actual = self.compareStubs(run_queries)
+    self.assertEqual([[9, 8, 7, 6], [5, 4, 3, 2], [1, 0]], actual)
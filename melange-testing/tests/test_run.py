@@ -0,0 +1,186 @@
+#!/usr/bin/env python2.5
+#
+# Copyright 2012 the Melange authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the scheduling and history helpers of the test runner.
+"""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import run
+
+
+class FakeQueue(object):
+  """Queue which records the items that are put on it.
+  """
+
+  def __init__(self):
+    self.items = []
+
+  def put(self, item, block=True, timeout=None):
+    self.items.append(item)
+
+
+class BatchingTestQueueTest(unittest.TestCase):
+  """Tests for BatchingTestQueue.
+  """
+
+  def flush(self, names, size, durations=None):
+    """Queues the tests with names and returns the names in each batch.
+    """
+    queue = FakeQueue()
+    batching_queue = run.BatchingTestQueue(queue, size, durations)
+    for name in names:
+      batching_queue.put((name, None))
+    self.assertEqual([], queue.items)
+    batching_queue.flush()
+    return [[test_addr for test_addr, _ in batch] for batch in queue.items]
+
+  def testNoHistory(self):
+    """Tests that without durations tests are queued in collection order.
+    """
+    batches = self.flush(['a', 'b', 'c', 'd', 'e'], 2)
+    self.assertEqual([['a', 'b'], ['c', 'd'], ['e']], batches)
+
+  def testLongestFirst(self):
+    """Tests that the longest tests are queued first.
+    """
+    durations = {'a': 1.0, 'b': 3.0, 'c': 2.0}
+    batches = self.flush(['a', 'b', 'c'], 1, durations)
+    self.assertEqual([['b'], ['c'], ['a']], batches)
+
+  def testStableTies(self):
+    """Tests that tests with equal durations keep their collection order.
+    """
+    durations = {'a': 1.0, 'b': 2.0, 'c': 1.0, 'd': 2.0, 'e': 1.0}
+    batches = self.flush(['a', 'b', 'c', 'd', 'e'], 1, durations)
+    self.assertEqual([['b'], ['d'], ['a'], ['c'], ['e']], batches)
+
+  def testBatchLength(self):
+    """Tests that no batch is expected to take longer than the longest test.
+    """
+    durations = {'a': 10.0, 'b': 6.0, 'c': 4.0, 'd': 3.0, 'e': 1.0}
+    batches = self.flush(['e', 'd', 'c', 'b', 'a'], 4, durations)
+    self.assertEqual([['a'], ['b', 'c'], ['d', 'e']], batches)
+
+  def testBatchSize(self):
+    """Tests that no batch holds more than size tests.
+    """
+    durations = {'a': 10.0, 'b': 1.0, 'c': 1.0, 'd': 1.0}
+    batches = self.flush(['a', 'b', 'c', 'd'], 2, durations)
+    self.assertEqual([['a'], ['b', 'c'], ['d']], batches)
+
+  def testUnknownDuration(self):
+    """Tests that tests without a duration are expected to take average time.
+    """
+    durations = {'a': 1.0, 'b': 5.0}
+    batches = self.flush(['a', 'b', 'c'], 1, durations)
+    self.assertEqual([['b'], ['c'], ['a']], batches)
+
+  def testEmpty(self):
+    """Tests that nothing is queued if no tests were collected.
+    """
+    self.assertEqual([], self.flush([], 4))
+
+
+class HistoryTest(unittest.TestCase):
+  """Tests for load_history and save_history.
+  """
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, '.test_history')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def writePart(self, pid, entries, mtime):
+    """Writes the part file of the worker with pid and sets its mtime.
+    """
+    path = '%s.%d' % (self.path, pid)
+    run.save_history(entries, path)
+    os.utime(path, (mtime, mtime))
+
+  def testSaveAndLoad(self):
+    """Tests that saved entries are loaded again.
+    """
+    entries = {'test_a': '1.500', 'test_b': 'app/soc/a.py:1-3,5'}
+    run.save_history(entries, self.path)
+    self.assertEqual(entries, run.load_history(self.path))
+
+  def testNoHistory(self):
+    """Tests that a missing history file is loaded as no entries.
+    """
+    self.assertEqual({}, run.load_history(self.path))
+
+  def testAppend(self):
+    """Tests that entries are appended in mode 'a'.
+    """
+    run.save_history({'test_a': '1'}, self.path)
+    run.save_history({'test_b': '2'}, self.path, mode='a')
+    self.assertEqual({'test_a': '1', 'test_b': '2'},
+                     run.load_history(self.path))
+
+  def testMalformedLines(self):
+    """Tests that lines without a tab are ignored.
+    """
+    history = open(self.path, 'w')
+    history.write('test_a\t1\nmalformed\n')
+    history.close()
+    self.assertEqual({'test_a': '1'}, run.load_history(self.path))
+
+  def testMergePartFiles(self):
+    """Tests that part files are merged into the history file and removed.
+    """
+    run.save_history({'test_a': '1', 'test_b': '1'}, self.path)
+    self.writePart(100, {'test_b': '2', 'test_c': '2'}, 1000)
+
+    expected = {'test_a': '1', 'test_b': '2', 'test_c': '2'}
+    self.assertEqual(expected, run.load_history(self.path))
+    self.assertEqual(['.test_history'], os.listdir(self.directory))
+    self.assertEqual(expected, run.load_history(self.path))
+
+  def testMergeNewestLast(self):
+    """Tests that part files are merged by age rather than by pid.
+    """
+    self.writePart(10000, {'test_a': 'new'}, 2000)
+    self.writePart(9000, {'test_a': 'old'}, 1000)
+    self.assertEqual({'test_a': 'new'}, run.load_history(self.path))
+
+
+class ImpactLinesTest(unittest.TestCase):
+  """Tests for format_lines and touches_lines.
+  """
+
+  def testFormatLines(self):
+    """Tests that consecutive lines are formatted as ranges.
+    """
+    lines = {'b.py': set([7]), 'a.py': set([1, 2, 3, 5, 8, 9])}
+    self.assertEqual('a.py:1-3,5,8-9 b.py:7', run.format_lines(lines))
+    self.assertEqual('', run.format_lines({}))
+
+  def testTouchesLines(self):
+    """Tests that only changed lines within the recorded ranges count.
+    """
+    value = 'a.py:1-3,8-9 b.py:7'
+    self.assertTrue(run.touches_lines(value, {'a.py': set([2])}))
+    self.assertTrue(run.touches_lines(value, {'b.py': set([7])}))
+    self.assertFalse(run.touches_lines(value, {'a.py': set([4, 10])}))
+    self.assertFalse(run.touches_lines(value, {'c.py': set([1])}))
+    self.assertFalse(run.touches_lines('', {'a.py': set([1])}))
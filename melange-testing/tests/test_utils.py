@@ -24,10 +24,12 @@ import datetime
 import httplib
 import StringIO
 import unittest
+import urllib
 
 import gaetestbed
 from mox import stubout
 
+from google.appengine.api import apiproxy_stub_map
 from google.appengine.ext import db
 
 from django.test import client
@@ -38,6 +40,17 @@ from soc.middleware.xsrf import XsrfMiddleware
 from soc.modules import callback
 
 
+# names of the ProgramHelper attributes which make up the baseline fixtures
+BASELINE_FIXTURES = [
+    'founder', 'sponsor', 'program', 'program_timeline', 'program_messages',
+    'site', 'org', 'org_app',
+]
+
+# maps a program type to the snapshot of its baseline fixtures, so that
+# they are seeded at most once per process
+_baseline_snapshots = {}
+
+
 class MockRequest(object):
   """Shared dummy request object to mock common aspects of a request.
 
@@ -169,8 +182,57 @@ class SoCTestCase(unittest.TestCase):
 
     Sets the following attributes:
       dev_test: True iff DEV_TEST is in environment (in parent)
+
+    Also resets the clock used by the test helpers to the real clock.
     """
+    from tests import clock_utils
     self.dev_test = 'DEV_TEST' in os.environ
+    clock_utils.setClock(clock_utils.Clock())
+
+  def freezeClock(self, now=None):
+    """Freezes the clock used by the test helpers and returns it.
+
+    The returned clock can be advanced to move all dates computed by the
+    helpers afterwards, e.g. by the timeline helper, forward in time.
+
+    Args:
+      now: the date at which the clock is frozen, defaults to the
+          current date
+    """
+    from tests import clock_utils
+    return clock_utils.setClock(clock_utils.FrozenClock(now))
+
+  def initBaseline(self, name):
+    """Seeds the baseline fixtures using self.program_helper.
+
+    The fixtures are seeded only the first time this is called in the
+    current process for the specified name, after which a snapshot of the
+    datastore is taken. Subsequent calls restore that snapshot instead.
+
+    Args:
+      name: the name under which the snapshot is stored, e.g. 'gsoc'
+    """
+    from tests.snapshot_utils import DatastoreSnapshot
+    from tests.snapshot_utils import isDatastoreEmpty
+
+    snapshot = _baseline_snapshots.get(name)
+    if snapshot and isDatastoreEmpty():
+      for attr, entity in snapshot.restore().iteritems():
+        setattr(self.program_helper, attr, entity)
+      return
+
+    # only snapshot the datastore if it holds nothing but the baseline
+    capture = isDatastoreEmpty()
+    self.program_helper.createFounder()
+    self.program_helper.createSponsor()
+    self.program_helper.createProgram()
+    self.program_helper.createSite()
+    self.program_helper.createOrg()
+    self.program_helper.createOrgApp()
+    if capture:
+      keys = dict((attr, getattr(self.program_helper, attr).key())
+                  for attr in BASELINE_FIXTURES)
+      _baseline_snapshots[name] = DatastoreSnapshot.capture(keys)
 
   def assertItemsEqual(self, expected_seq, actual_seq, msg=''):
     """An unordered sequence / set specific comparison.
@@ -236,12 +298,13 @@ class GSoCTestCase(SoCTestCase):
     from tests.profile_utils import GSoCProfileHelper
     super(GSoCTestCase, self).init()
     self.program_helper = GSoCProgramHelper()
-    self.founder = self.program_helper.createFounder()
-    self.sponsor = self.program_helper.createSponsor()
-    self.gsoc = self.program = self.program_helper.createProgram()
-    self.site = self.program_helper.createSite()
-    self.org = self.program_helper.createOrg()
-    self.org_app = self.program_helper.createOrgApp()
+    self.initBaseline('gsoc')
+    self.founder = self.program_helper.founder
+    self.sponsor = self.program_helper.sponsor
+    self.gsoc = self.program = self.program_helper.program
+    self.site = self.program_helper.site
+    self.org = self.program_helper.org
+    self.org_app = self.program_helper.org_app
     self.timeline = GSoCTimelineHelper(self.gsoc.timeline, self.org_app)
     self.data = GSoCProfileHelper(self.gsoc, self.dev_test)
 
@@ -268,12 +331,13 @@ class GCITestCase(SoCTestCase):
     from tests.profile_utils import GCIProfileHelper
     super(GCITestCase, self).init()
     self.program_helper = GCIProgramHelper()
-    self.founder = self.program_helper.createFounder()
-    self.sponsor = self.program_helper.createSponsor()
-    self.gci = self.program = self.program_helper.createProgram()
-    self.site = self.program_helper.createSite()
-    self.org = self.program_helper.createOrg()
-    self.org_app = self.program_helper.createOrgApp()
+    self.initBaseline('gci')
+    self.founder = self.program_helper.founder
+    self.sponsor = self.program_helper.sponsor
+    self.gci = self.program = self.program_helper.program
+    self.site = self.program_helper.site
+    self.org = self.program_helper.org
+    self.org_app = self.program_helper.org_app
     self.timeline = GCITimelineHelper(self.gci.timeline, self.org_app)
     self.data = GCIProfileHelper(self.gci, self.dev_test)
 
@@ -413,32 +477,44 @@ class DjangoTestCase(TestCase):
 
   def getListResponse(self, url, idx, start=None, limit=None):
     """Returns the list reponse for the specified url and index.
+
+    The start token is passed on as an opaque value, e.g. a datastore
+    cursor, so it is escaped before it is put in the url.
     """
-    url = [url,'?fmt=json&marker=1&&idx=', str(idx)]
+    url = [url,'?fmt=json&marker=1&idx=', str(idx)]
     if limit:
       url += ["&limit=", str(limit)]
     if start:
-      url += ['&start=', start]
+      url += ['&start=', urllib.quote(start, safe='')]
     return self.client.get(''.join(url))
 
   def getListData(self, url, idx):
     """Returns all data from a list view.
     """
-    result = []
-    start = ''
+    return list(self.iterListData(url, idx))
+
+  def iterListData(self, url, idx, limit=1000):
+    """Yields the rows of a list view as the pages of the list arrive.
 
-    i = 0
+    Args:
+      url: the url of the list view
+      idx: the index of the list on the page
+      limit: the number of rows requested per page
+    """
+    for data in self._iterListPages(url, idx, limit):
+      for row in data:
+        yield row
 
+  def _iterListPages(self, url, idx, limit):
+    """Yields the data of each page of a list view in turn.
+    """
+    start = ''
     while start != 'done':
-      i += 1
-      response = self.getListResponse(url, idx, start, 1000)
-      data = response.context['data'][start]
+      response = self.getListResponse(url, idx, start, limit)
       self.assertIsJsonResponse(response)
-      result += data
+      yield response.context['data'][start]
       start = response.context['next']
 
-    return result
-
   def assertRenderAll(self, response):
     """Calls render on all objects that are renderable.
     """
@@ -643,20 +719,48 @@ class GCIDjangoTestCase(DjangoTestCase, GCITestCase):
 
 def runTasks(url = None, name=None, queue_names = None):
   """Run tasks with specified url and name in specified task queues.
+
+  Each task is removed from its queue before it is run, so that it is run
+  only once even if this is called again, e.g. by several assertions.
   """
+  for task in popTasks(url=url, name=name, queue_names=queue_names):
+    postTask(task['url'], task['params'])
+
+
+def popTasks(url=None, name=None, queue_names=None):
+  """Removes the tasks with specified url and name from specified task queues.
+
+  Returns:
+    A list of the removed tasks, as returned by
+    gaetestbed.taskqueue.TaskQueueTestCase.get_tasks, except that the
+    values in their params are already decoded.
+  """
+  stub = apiproxy_stub_map.apiproxy.GetStub('taskqueue')
+  if queue_names is None:
+    queue_names = [queue['name'] for queue in stub.GetQueues()]
 
   task_queue_test_case = gaetestbed.taskqueue.TaskQueueTestCase()
-  # Get all tasks with specified url and name in specified task queues
-  tasks = task_queue_test_case.get_tasks(url=url, name=name, 
-                                         queue_names=queue_names)
-  for task in tasks:
-    postdata = task['params']
-    xsrf_token = GSoCDjangoTestCase.getXsrfToken(url, data=postdata)
-    postdata.update(xsrf_token=xsrf_token)
-    client.FakePayload = NonFailingFakePayload
-    c = client.Client()
-    # Run the task with Django test client
-    c.post(url, postdata)
+  tasks = []
+  for queue_name in queue_names:
+    # Get all tasks with specified url and name in the queue
+    queue_tasks = task_queue_test_case.get_tasks(url=url, name=name,
+                                                 queue_names=[queue_name])
+    for task in queue_tasks:
+      stub.DeleteTask(queue_name, task['name'])
+      task['params'] = dict((key, urllib.unquote_plus(value))
+                            for key, value in task['params'].iteritems())
+    tasks.extend(queue_tasks)
+  return tasks
+
+
+def postTask(url, postdata):
+  """Runs the task at url with postdata using the Django test client.
+  """
+  xsrf_token = GSoCDjangoTestCase.getXsrfToken(url, data=postdata)
+  postdata.update(xsrf_token=xsrf_token)
+  client.FakePayload = NonFailingFakePayload
+  c = client.Client()
+  return c.post(url, postdata)
 
 
 class MailTestCase(gaetestbed.mail.MailTestCase, unittest.TestCase):
@@ -763,3 +867,33 @@ class TaskQueueTestCase(gaetestbed.taskqueue.TaskQueueTestCase,
     """
 
     super(TaskQueueTestCase, self).setUp()
+
+  def executeTasks(self, url=None, queue_names=None, max_tasks=100):
+    """Runs queued tasks until no more tasks with the specified url are left.
+
+    Each task is removed from its queue before it is run, and tasks that
+    are enqueued by the tasks being run are run as well, so that whole
+    chains and fan-outs of tasks are executed, e.g. all shards of a task
+    and the task which merges their results.
+
+    Args:
+      url: the url of the tasks to run, defaults to all tasks
+      queue_names: the names of the queues to run tasks from, defaults
+          to all queues
+      max_tasks: the maximum number of tasks to run, after which the test
+          fails, so that tasks which keep enqueuing themselves terminate
+
+    Returns:
+      A list with the response to each task that was run, in the order
+      in which they were run.
+    """
+    responses = []
+    while True:
+      tasks = popTasks(url=url, queue_names=queue_names)
+      if not tasks:
+        return responses
+
+      for task in tasks:
+        if len(responses) >= max_tasks:
+          self.fail('More than %d tasks were run.' % max_tasks)
+        responses.append(postTask(task['url'], task['params']))
@@ -19,306 +19,334 @@
 """
 
 
-from datetime import datetime
 from datetime import timedelta
 
+from google.appengine.ext import db
 
-def past(delta=100):
+from tests import clock_utils
+
+
+# markers used in the phase tables for dates in the past and in the future
+PAST = 'past'
+FUTURE = 'future'
+
+
+def past(delta=100, now=None):
   """Returns a date that is delta days past today.
+
+  Args:
+    delta: the number of days
+    now: the date to use as today, defaults to the date of the current
+        clock_utils clock
   """
-  return datetime.today() - timedelta(delta)
+  if now is None:
+    now = clock_utils.now()
+  return now - timedelta(delta)
 
 
-def future(delta=100):
+def future(delta=100, now=None):
   """Returns a date that is delta days future today.
+
+  Args:
+    delta: the number of days
+    now: the date to use as today, defaults to the date of the current
+        clock_utils clock
   """
-  return datetime.today() + timedelta(delta)
+  if now is None:
+    now = clock_utils.now()
+  return now + timedelta(delta)
 
 
 class TimelineHelper(object):
   """Base helper class to aid in setting the timeline.
+
+  Each phase is described in PHASES as the dates of the timeline and org
+  app fields, which are either PAST or FUTURE. Switching to a phase first
+  resets the fields in EMPTY_FIELDS, then sets the fields of the phase and
+  stores both entities with a single batched put.
   """
 
-  def __init__(self, timeline, org_appl):
+  # fields that are stored on the org app rather than on the timeline
+  ORG_APP_FIELDS = ['survey_start', 'survey_end']
+
+  # fields that are reset to None before switching to a phase
+  EMPTY_FIELDS = [
+      'program_start', 'program_end', 'survey_start', 'survey_end',
+      'accepted_organization_announced_deadline',
+      'student_signup_start', 'student_signup_end',
+  ]
+
+  PHASES = {
+      'offSeason': {
+          'program_start': PAST,
+          'program_end': PAST,
+          'survey_start': PAST,
+          'survey_end': PAST,
+          'accepted_organization_announced_deadline': PAST,
+          'student_signup_start': PAST,
+          'student_signup_end': PAST,
+      },
+      'kickoff': {
+          'program_start': PAST,
+          'program_end': FUTURE,
+          'survey_start': FUTURE,
+          'survey_end': FUTURE,
+          'accepted_organization_announced_deadline': FUTURE,
+          'student_signup_start': FUTURE,
+          'student_signup_end': FUTURE,
+      },
+      'orgSignup': {
+          'program_start': PAST,
+          'program_end': FUTURE,
+          'survey_start': PAST,
+          'survey_end': FUTURE,
+          'accepted_organization_announced_deadline': FUTURE,
+          'student_signup_start': FUTURE,
+          'student_signup_end': FUTURE,
+      },
+      'orgsAnnounced': {
+          'program_start': PAST,
+          'program_end': FUTURE,
+          'survey_start': PAST,
+          'survey_end': PAST,
+          'accepted_organization_announced_deadline': PAST,
+          'student_signup_start': FUTURE,
+          'student_signup_end': FUTURE,
+      },
+      'studentSignup': {
+          'program_start': PAST,
+          'program_end': FUTURE,
+          'survey_start': PAST,
+          'survey_end': PAST,
+          'accepted_organization_announced_deadline': PAST,
+          'student_signup_start': PAST,
+          'student_signup_end': FUTURE,
+      },
+  }
+
+  def __init__(self, timeline, org_appl, now=None):
+    """Initializes the TimelineHelper.
+
+    Args:
+      timeline: the timeline entity
+      org_appl: the org app survey entity
+      now: a function returning the current date, used once per phase
+          switch, defaults to the current clock_utils clock
+    """
     self.timeline = timeline
     # org_appl instead of org_app so that it is the same length as timeline
     self.org_appl = org_appl
+    self.now = now or clock_utils.now
+
+  def _entityFor(self, field):
+    """Returns the entity on which field is stored.
+    """
+    if field in self.ORG_APP_FIELDS:
+      return self.org_appl
+    return self.timeline
 
   def _empty(self):
     """Removes all timeline settings.
 
     Note: does not save changes.
     """
-    self.timeline.program_start = None
-    self.timeline.program_end = None
-    self.org_appl.survey_start = None
-    self.org_appl.survey_end = None
-    self.timeline.accepted_organization_announced_deadline = None
-    self.timeline.student_signup_start = None
-    self.timeline.student_signup_end = None
+    for field in self.EMPTY_FIELDS:
+      setattr(self._entityFor(field), field, None)
+
+  def setPhase(self, phase):
+    """Sets the current period to the specified phase of PHASES.
+    """
+    self._empty()
+    now = self.now()
+    dates = {PAST: past(now=now), FUTURE: future(now=now)}
+    for field, when in self.PHASES[phase].iteritems():
+      setattr(self._entityFor(field), field, dates[when])
+    self.commit()
+
+  def commit(self):
+    """Stores the timeline and the org app with a single put.
+    """
+    db.put([self.timeline, self.org_appl])
 
   def offSeason(self):
     """Sets the current period to off season.
     """
-    self._empty()
-    self.timeline.program_start = past()
-    self.timeline.program_end = past()
-    self.org_appl.survey_start = past()
-    self.org_appl.survey_end = past()
-    self.timeline.accepted_organization_announced_deadline = past()
-    self.timeline.student_signup_start = past()
-    self.timeline.student_signup_end = past()
+    self.setPhase('offSeason')
 
   def kickoff(self):
     """Sets the current period to the program kickoff.
     """
-    self._empty()
-    self.timeline.program_start = past()
-    self.timeline.program_end = future()
-    self.org_appl.survey_start = future()
-    self.org_appl.survey_end = future()
-    self.timeline.accepted_organization_announced_deadline = future()
-    self.timeline.student_signup_start = future()
-    self.timeline.student_signup_end = future()
+    self.setPhase('kickoff')
 
   def orgSignup(self):
     """Sets the current period to the organization signup phase.
     """
-    self._empty()
-    self.timeline.program_start = past()
-    self.timeline.program_end = future()
-    self.org_appl.survey_start = past()
-    self.org_appl.survey_end = future()
-    self.timeline.accepted_organization_announced_deadline = future()
-    self.timeline.student_signup_start = future()
-    self.timeline.student_signup_end = future()
+    self.setPhase('orgSignup')
 
   def orgsAnnounced(self):
     """Sets the current period to the organization signup phase.
     """
-    self._empty()
-    self.timeline.program_start = past()
-    self.timeline.program_end = future()
-    self.org_appl.survey_start = past()
-    self.org_appl.survey_end = past()
-    self.timeline.accepted_organization_announced_deadline = past()
-    self.timeline.student_signup_start = future()
-    self.timeline.student_signup_end = future()
+    self.setPhase('orgsAnnounced')
 
   def studentSignup(self):
     """Sets the current period to the student signup phase.
     """
-    self._empty()
-    self.timeline.program_start = past()
-    self.timeline.program_end = future()
-    self.org_appl.survey_start = past()
-    self.org_appl.survey_end = past()
-    self.timeline.accepted_organization_announced_deadline = past()
-    self.timeline.student_signup_start = past()
-    self.timeline.student_signup_end = future()
+    self.setPhase('studentSignup')
 
 
-class GSoCTimelineHelper(TimelineHelper):
-  """Helper class to aid in setting the GSoC timeline.
+def _extendPhases(phases, extensions):
+  """Returns a copy of phases with the fields in extensions added.
   """
+  result = {}
+  for phase, fields in phases.iteritems():
+    result[phase] = dict(fields)
+  for phase, fields in extensions.iteritems():
+    result.setdefault(phase, {}).update(fields)
+  return result
 
-  def __init__(self, timeline, org_appl):
-    super(GSoCTimelineHelper, self).__init__(timeline, org_appl)
-
-  def _empty(self):
-    """Removes all timeline settings.
-
-    Note: does not save changes.
-    """
-    super(GSoCTimelineHelper, self)._empty()
-    self.timeline.accepted_students_announced_deadline = None
-
-  def offSeason(self):
-    """Sets the current period to off season.
-    """
-    super(GSoCTimelineHelper, self).offSeason()
-    self.timeline.accepted_students_announced_deadline = past()
-    self.timeline.put()
-    self.org_appl.put()
-
-  def kickoff(self):
-    """Sets the current period to the program kickoff.
-    """
-    super(GSoCTimelineHelper, self).kickoff()
-    self.timeline.accepted_students_announced_deadline = future()
-    self.timeline.put()
-    self.org_appl.put()
-
-  def orgSignup(self):
-    """Sets the current period to the organization signup phase.
-    """
-    super(GSoCTimelineHelper, self).orgSignup()
-    self.timeline.accepted_students_announced_deadline = future()
-    self.timeline.put()
-    self.org_appl.put()
 
-  def orgsAnnounced(self):
-    """Sets the current period to the organization signup phase.
-    """
-    super(GSoCTimelineHelper, self).orgsAnnounced()
-    self.timeline.accepted_students_announced_deadline = future()
-    self.timeline.put()
-    self.org_appl.put()
+class GSoCTimelineHelper(TimelineHelper):
+  """Helper class to aid in setting the GSoC timeline.
+  """
 
-  def studentSignup(self):
-    """Sets the current period to the student signup phase.
-    """
-    super(GSoCTimelineHelper, self).studentSignup()
-    self.timeline.accepted_students_announced_deadline = future()
-    self.timeline.put()
-    self.org_appl.put()
+  EMPTY_FIELDS = TimelineHelper.EMPTY_FIELDS + [
+      'accepted_students_announced_deadline',
+  ]
+
+  PHASES = _extendPhases(TimelineHelper.PHASES, {
+      'offSeason': {
+          'accepted_students_announced_deadline': PAST,
+      },
+      'kickoff': {
+          'accepted_students_announced_deadline': FUTURE,
+      },
+      'orgSignup': {
+          'accepted_students_announced_deadline': FUTURE,
+      },
+      'orgsAnnounced': {
+          'accepted_students_announced_deadline': FUTURE,
+      },
+      'studentSignup': {
+          'accepted_students_announced_deadline': FUTURE,
+      },
+      'postStudentSignup': {
+          'program_start': PAST,
+          'program_end': FUTURE,
+          'survey_start': PAST,
+          'survey_end': PAST,
+          'accepted_organization_announced_deadline': PAST,
+          'student_signup_start': PAST,
+          'student_signup_end': PAST,
+          'accepted_students_announced_deadline': FUTURE,
+      },
+      'studentsAnnounced': {
+          'program_start': PAST,
+          'program_end': FUTURE,
+          'survey_start': PAST,
+          'survey_end': PAST,
+          'accepted_organization_announced_deadline': PAST,
+          'student_signup_start': PAST,
+          'student_signup_end': PAST,
+          'accepted_students_announced_deadline': PAST,
+      },
+  })
 
   def postStudentSignup(self):
     """Sets the current period to after the signup phase.
     """
-    self._empty()
-    self.timeline.program_start = past()
-    self.timeline.program_end = future()
-    self.org_appl.survey_start = past()
-    self.org_appl.survey_end = past()
-    self.timeline.accepted_organization_announced_deadline = past()
-    self.timeline.student_signup_start = past()
-    self.timeline.student_signup_end = past()
-    self.timeline.accepted_students_announced_deadline = future()
-    self.timeline.put()
-    self.org_appl.put()
+    self.setPhase('postStudentSignup')
 
   def studentsAnnounced(self):
     """Sets the current period to be future accepted students announced phase.
     """
-    self._empty()
-    self.timeline.program_start = past()
-    self.timeline.program_end = future()
-    self.org_appl.survey_start = past()
-    self.org_appl.survey_end = past()
-    self.timeline.accepted_organization_announced_deadline = past()
-    self.timeline.student_signup_start = past()
-    self.timeline.student_signup_end = past()
-    self.timeline.accepted_students_announced_deadline = past()
-    self.timeline.put()
-    self.org_appl.put()
+    self.setPhase('studentsAnnounced')
 
 
 class GCITimelineHelper(TimelineHelper):
   """Helper class to aid in setting the GCI timeline.
   """
 
-  def __init__(self, timeline, org_appl):
-    super(GCITimelineHelper, self).__init__(timeline, org_appl)
-
-  def _empty(self):
-    """Removes all timeline settings.
-
-    Note: does not save changes.
-    """
-    super(GCITimelineHelper, self)._empty()
-    self.timeline.tasks_publicly_visible = None
-    self.timeline.task_claim_deadline = None
-    self.timeline.stop_all_work_deadline = None
-
-  def offSeason(self):
-    """Sets the current period to off season.
-    """
-    super(GCITimelineHelper, self).offSeason()
-    self.timeline.tasks_publicly_visible = past()
-    self.timeline.task_claim_deadline = past()
-    self.timeline.stop_all_work_deadline = past()
-    self.timeline.put()
-    self.org_appl.put()
-
-  def kickoff(self):
-    """Sets the current period to the program kickoff.
-    """
-    super(GCITimelineHelper, self).kickoff()
-    self.timeline.tasks_publicly_visible = future()
-    self.timeline.task_claim_deadline = future()
-    self.timeline.stop_all_work_deadline = future()
-    self.timeline.put()
-    self.org_appl.put()
-
-  def orgSignup(self):
-    """Sets the current period to the organization signup phase.
-    """
-    super(GCITimelineHelper, self).orgSignup()
-    self.timeline.tasks_publicly_visible = future()
-    self.timeline.task_claim_deadline = future()
-    self.timeline.stop_all_work_deadline = future()
-    self.timeline.put()
-    self.org_appl.put()
-
-  def orgsAnnounced(self):
-    """Sets the current period to the organization signup phase.
-    """
-    super(GCITimelineHelper, self).orgsAnnounced()
-    self.timeline.tasks_publicly_visible = future()
-    self.timeline.task_claim_deadline = future()
-    self.timeline.stop_all_work_deadline = future()
-    self.timeline.put()
-    self.org_appl.put()
+  EMPTY_FIELDS = TimelineHelper.EMPTY_FIELDS + [
+      'tasks_publicly_visible', 'task_claim_deadline',
+      'stop_all_work_deadline',
+  ]
+
+  PHASES = _extendPhases(TimelineHelper.PHASES, {
+      'offSeason': {
+          'tasks_publicly_visible': PAST,
+          'task_claim_deadline': PAST,
+          'stop_all_work_deadline': PAST,
+      },
+      'kickoff': {
+          'tasks_publicly_visible': FUTURE,
+          'task_claim_deadline': FUTURE,
+          'stop_all_work_deadline': FUTURE,
+      },
+      'orgSignup': {
+          'tasks_publicly_visible': FUTURE,
+          'task_claim_deadline': FUTURE,
+          'stop_all_work_deadline': FUTURE,
+      },
+      'orgsAnnounced': {
+          'tasks_publicly_visible': FUTURE,
+          'task_claim_deadline': FUTURE,
+          'stop_all_work_deadline': FUTURE,
+      },
+      'tasksPubliclyVisible': {
+          'program_start': PAST,
+          'program_end': FUTURE,
+          'survey_start': PAST,
+          'survey_end': PAST,
+          'accepted_organization_announced_deadline': PAST,
+          'student_signup_start': FUTURE,
+          'student_signup_end': FUTURE,
+          'tasks_publicly_visible': PAST,
+          'task_claim_deadline': FUTURE,
+          'stop_all_work_deadline': FUTURE,
+          'work_review_deadline': FUTURE,
+      },
+      'studentSignup': {
+          'tasks_publicly_visible': PAST,
+          'task_claim_deadline': FUTURE,
+          'stop_all_work_deadline': FUTURE,
+      },
+      'taskClaimEnded': {
+          'program_start': PAST,
+          'program_end': FUTURE,
+          'survey_start': PAST,
+          'survey_end': PAST,
+          'accepted_organization_announced_deadline': PAST,
+          'student_signup_start': PAST,
+          'student_signup_end': FUTURE,
+          'tasks_publicly_visible': PAST,
+          'task_claim_deadline': PAST,
+          'stop_all_work_deadline': FUTURE,
+      },
+      'pencilDown': {
+          'program_start': PAST,
+          'program_end': FUTURE,
+          'survey_start': PAST,
+          'survey_end': PAST,
+          'accepted_organization_announced_deadline': PAST,
+          'student_signup_start': PAST,
+          'student_signup_end': FUTURE,
+          'tasks_publicly_visible': PAST,
+          'task_claim_deadline': PAST,
+          'stop_all_work_deadline': PAST,
+      },
+  })
 
   def tasksPubliclyVisible(self):
     """Sets the current period to the tasks publicly visible phase.
     """
-    self._empty()
-    self.timeline.program_start = past()
-    self.timeline.program_end = future()
-    self.org_appl.survey_start = past()
-    self.org_appl.survey_end = past()
-    self.timeline.accepted_organization_announced_deadline = past()
-    self.timeline.student_signup_start = future()
-    self.timeline.student_signup_end = future()
-    self.timeline.tasks_publicly_visible = past()
-    self.timeline.task_claim_deadline = future()
-    self.timeline.stop_all_work_deadline = future()
-    self.timeline.work_review_deadline = future()
-    self.timeline.put()
-    self.org_appl.put()
-
-  def studentSignup(self):
-    """Sets the current period to the student signup phase.
-    """
-    super(GCITimelineHelper, self).studentSignup()
-    self.timeline.tasks_publicly_visible = past()
-    self.timeline.task_claim_deadline = future()
-    self.timeline.stop_all_work_deadline = future()
-    self.timeline.put()
-    self.org_appl.put()
+    self.setPhase('tasksPubliclyVisible')
 
   def taskClaimEnded(self):
     """Sets the current period to the task claim ended phase.
     """
-    self._empty()
-    self.timeline.program_start = past()
-    self.timeline.program_end = future()
-    self.org_appl.survey_start = past()
-    self.org_appl.survey_end = past()
-    self.timeline.accepted_organization_announced_deadline = past()
-    self.timeline.student_signup_start = past()
-    self.timeline.student_signup_end = future()
-    self.timeline.tasks_publicly_visible = past()
-    self.timeline.task_claim_deadline = past()
-    self.timeline.stop_all_work_deadline = future()
-    self.timeline.put()
-    self.org_appl.put()
+    self.setPhase('taskClaimEnded')
 
   def pencilDown(self):
     """Sets the current period to the phase when all work should stop.
     """
-    self._empty()
-    self.timeline.program_start = past()
-    self.timeline.program_end = future()
-    self.org_appl.survey_start = past()
-    self.org_appl.survey_end = past()
-    self.timeline.accepted_organization_announced_deadline = past()
-    self.timeline.student_signup_start = past()
-    self.timeline.student_signup_end = future()
-    self.timeline.tasks_publicly_visible = past()
-    self.timeline.task_claim_deadline = past()
-    self.timeline.stop_all_work_deadline = past()
-    self.timeline.put()
-    self.org_appl.put()
+    self.setPhase('pencilDown')